@@ -0,0 +1,107 @@
+"""
+Compare compose parsing with the pure Python and libyaml loaders, and with
+the ComposeCache, on generated compose files.
+
+    python benchmarks/compose_yaml.py [--services 10,100,1000] [--runs 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from theo.utils import ComposeCache  # noqa: E402
+
+
+def compose_doc(services):
+    return {
+        'version': '2',
+        'services': dict(('service{0}'.format(i), {
+            'image': 'registry.example.com/service{0}:latest'.format(i),
+            'command': 'gunicorn app:application -w 4',
+            'mem_limit': 512,
+            'ports': ['{0}:8000'.format(8000 + i)],
+            'dns': ['8.8.8.8', '8.8.4.4'],
+            'labels': ['team=platform', 'tier=web'],
+            'extra_hosts': ['db:10.0.0.1', 'cache:10.0.0.2'],
+            'ulimits': {'nofile': {'soft': 20000, 'hard': 40000}},
+        }) for i in range(services)),
+    }
+
+
+def write_compose(directory, services):
+    path = os.path.join(directory, 'docker-compose-{0}.yml'.format(services))
+    with open(path, 'w') as f:
+        yaml.safe_dump(compose_doc(services), f, default_flow_style=False)
+    return path
+
+
+def best_of(runs, func):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_with(path, loader):
+    with open(path, 'rb') as f:
+        return yaml.load(f, Loader=loader)
+
+
+def bench(path, services, runs):
+    result = {
+        'services': services,
+        'bytes': os.path.getsize(path),
+        'python_loader': best_of(runs, lambda: load_with(path,
+                                                         yaml.SafeLoader)),
+        'c_loader': None,
+    }
+    if getattr(yaml, '__with_libyaml__', False):
+        result['c_loader'] = best_of(runs, lambda: load_with(
+            path, yaml.CSafeLoader))
+    cache = ComposeCache()
+    cache.load(path)
+    result['cached'] = best_of(runs, lambda: cache.load(path))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--services', default='10,100,1000')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='Print machine-readable results')
+    opts = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='theo-bench-')
+    try:
+        results = []
+        for services in [int(i) for i in opts.services.split(',')]:
+            path = write_compose(directory, services)
+            results.append(bench(path, services, opts.runs))
+    finally:
+        shutil.rmtree(directory)
+
+    if opts.json:
+        print(json.dumps(results, indent=4))
+        return
+    for r in results:
+        c_loader = '{0:.4f}s'.format(r['c_loader']) if r['c_loader'] \
+            else 'n/a (no libyaml)'
+        print('{services:>5} services {bytes:>9} bytes  '
+              'python {python_loader:.4f}s  c {0}  '
+              'cached {cached:.4f}s'.format(c_loader, **r))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Offline benchmark suite for theo's hot paths. AWS and docker are replaced
+by the fakes in fakes.py, so no network or credentials are needed.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --baseline results.json --threshold 0.25
+
+Every metric is a duration in seconds, the best of --runs repetitions.
+With --baseline the run fails (exit status 1) when a metric is slower than
+its baseline by more than --threshold.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from fakes import FAKE_CREDENTIALS, FakeAWS, FakeDockerDaemon  # noqa: E402
+from compose_yaml import compose_doc  # noqa: E402
+import startup  # noqa: E402
+
+RENDER_SIZES = (10, 100, 1000)
+LIST_TASKS = 10000
+ENV_VARS = 200
+CONTEXT_FILES = 500
+
+SETTINGS = {
+    'aws_profile_name': None,
+    'aws_region_name': 'us-east-1',
+    'cluster': 'bench',
+}
+
+
+def best_of(runs, func, setup=None):
+    best = None
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_theo():
+    from theo.clients import ClientPool
+    from theo.theo import Theo
+
+    # The fakes answer instantly, a rate limit would only measure itself
+    theo_ins = Theo(client_pool=ClientPool(rate_limiters=None))
+    theo_ins.settings = dict(SETTINGS)
+    return theo_ins
+
+
+def bench_startup(runs, workdir):
+    with open(os.path.join(workdir, '.theo'), 'w') as f:
+        json.dump({'bench': SETTINGS}, f)
+    results = {}
+    for args in startup.COMMANDS:
+        name = 'startup.' + args[0].lstrip('-')
+        results[name] = startup.bench(args, runs, workdir)['wall_min']
+    return results
+
+
+def bench_render(runs, workdir):
+    from theo.utils import ComposeCache, ComposeECS
+
+    env_path = os.path.join(workdir, 'settings.env')
+    with open(env_path, 'w') as f:
+        f.write('\n'.join('var{0} = value{0}'.format(i)
+                          for i in range(ENV_VARS)))
+    theo_ins = make_theo()
+    results = {}
+    for size in RENDER_SIZES:
+        doc = compose_doc(size)
+        for service in doc['services'].values():
+            service['env_file'] = env_path
+        path = os.path.join(workdir, 'compose-{0}.yml'.format(size))
+        with open(path, 'w') as f:
+            yaml.safe_dump(doc, f, default_flow_style=False)
+
+        results['render.{0}'.format(size)] = best_of(runs, lambda: ComposeECS(
+            theo_ins, 'bench', path, compose_cache=None).render())
+        cache = ComposeCache()
+        cache.load(path)
+        results['render.{0}.cached'.format(size)] = best_of(
+            runs, lambda: ComposeECS(theo_ins, 'bench', path,
+                                     compose_cache=cache).render())
+    return results
+
+
+def bench_list_tasks(runs, workdir):
+    fake = FakeAWS(tasks=LIST_TASKS)
+    theo_ins = make_theo()
+    fake.install(theo_ins.client('ecs'))
+    key = 'list_tasks.{0}'.format(LIST_TASKS)
+    return {
+        key: best_of(runs, lambda: sum(1 for _ in theo_ins.iter_tasks(
+            'bench'))),
+        key + '.arns': best_of(runs, lambda: theo_ins.list_tasks(
+            None, 'bench')),
+    }
+
+
+def bench_env_file(runs, workdir):
+    from theo.utils import ComposeECS, S3EnvCache
+
+    body = '\n'.join('var{0} = value{0}'.format(i)
+                     for i in range(ENV_VARS)).encode('utf-8')
+    fake = FakeAWS(s3_objects={('bench', 'settings.env'): body})
+    theo_ins = make_theo()
+    fake.install(theo_ins.client('s3'))
+    path = os.path.join(workdir, 'compose-env.yml')
+    with open(path, 'w') as f:
+        yaml.safe_dump({'services': {'web': {
+            'image': 'web', 'env_file': 's3://bench:settings.env'}}}, f)
+    cache_path = os.path.join(workdir, 's3env')
+
+    def reset_cache():
+        shutil.rmtree(cache_path, ignore_errors=True)
+        os.makedirs(cache_path)
+
+    def render():
+        ComposeECS(theo_ins, 'bench', path,
+                   env_cache=S3EnvCache(cache_path)).render()
+
+    return {
+        'env_file.s3.cold': best_of(runs, render, setup=reset_cache),
+        'env_file.s3.not_modified': best_of(runs, render),
+    }
+
+
+def bench_build_context(runs, workdir):
+    from theo.images import CONTEXT_DIGEST_LABEL, BuildContext
+
+    context = os.path.join(workdir, 'context')
+    os.makedirs(os.path.join(context, 'src'))
+    with open(os.path.join(context, 'Dockerfile'), 'w') as f:
+        f.write('FROM alpine\nCOPY . /app\n')
+    for i in range(CONTEXT_FILES):
+        with open(os.path.join(context, 'src', '{0}.py'.format(i)), 'w') as f:
+            f.write('x = {0}\n'.format(i) * 200)
+    dockerfile = os.path.join(context, 'Dockerfile')
+    digest = BuildContext(dockerfile).digest
+
+    socket_dir = tempfile.mkdtemp(prefix='theo-')
+    daemon = FakeDockerDaemon(os.path.join(socket_dir, 'docker.sock'), [
+        {'Id': 'sha256:bench', 'Labels': {CONTEXT_DIGEST_LABEL: digest}}])
+    try:
+        with daemon:
+            os.environ['DOCKER_HOST'] = daemon.base_url
+            theo_ins = make_theo()
+            results = {'build.context_digest': best_of(
+                runs, lambda: BuildContext(dockerfile).digest)}
+            try:
+                theo_ins.docker_client.version()
+            except Exception as e:
+                # docker-py's Unix socket adapter breaks with some requests
+                # releases, the build cache can't be measured then
+                sys.stderr.write('Skipping build.cache_hit: {0}\n'.format(e))
+                return results
+            results['build.cache_hit'] = best_of(
+                runs, lambda: theo_ins.build_dockerfile(dockerfile))
+            return results
+    finally:
+        os.environ.pop('DOCKER_HOST', None)
+        shutil.rmtree(socket_dir)
+
+
+BENCHMARKS = [
+    ('startup', bench_startup),
+    ('render', bench_render),
+    ('list_tasks', bench_list_tasks),
+    ('env_file', bench_env_file),
+    ('build', bench_build_context),
+]
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: List of (metric, baseline, current) for every regression
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous and value > previous * (1 + threshold):
+            regressions.append((name, previous, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--only', default=None,
+                        help='Comma separated benchmark names: {0}'.format(
+                            ', '.join(i[0] for i in BENCHMARKS)))
+    parser.add_argument('--output', default=None,
+                        help='Write the results to this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown against the baseline, 0.25 '
+                             'is 25%%')
+    opts = parser.parse_args()
+
+    os.environ.update(FAKE_CREDENTIALS)
+    os.environ['AWS_DEFAULT_REGION'] = SETTINGS['aws_region_name']
+    only = opts.only.split(',') if opts.only else None
+    workdir = tempfile.mkdtemp(prefix='theo-bench-')
+    os.environ['THEO_CACHE_DIR'] = os.path.join(workdir, 'cache')
+    results = {}
+    try:
+        for name, func in BENCHMARKS:
+            if only and name not in only:
+                continue
+            bench_dir = os.path.join(workdir, name)
+            os.makedirs(bench_dir)
+            results.update(func(opts.runs, bench_dir))
+    finally:
+        shutil.rmtree(workdir)
+
+    for name, value in sorted(results.items()):
+        print('{0:<32} {1:.4f}s'.format(name, value))
+    if opts.output:
+        with open(opts.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            regressions = compare(results, json.load(f), opts.threshold)
+        for name, previous, value in regressions:
+            print('REGRESSION {0}: {1:.4f}s -> {2:.4f}s (+{3:.0%})'.format(
+                name, previous, value, value / previous - 1))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
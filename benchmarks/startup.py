@@ -0,0 +1,101 @@
+"""
+Measure `theo` CLI startup: wall time and the number of modules imported.
+
+Every run happens in a fresh interpreter, in a scratch directory with a
+minimal .theo file so `list_profiles` works without touching AWS or docker.
+
+    python benchmarks/startup.py [--runs 20]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ['--help'],
+    ['list_profiles'],
+]
+
+# Runs inside the child interpreter. Reports how many modules the CLI
+# pulled in on top of a bare interpreter.
+CHILD = '''
+import json, sys
+baseline = len(sys.modules)
+from theo.cli import theo
+# Click >= 7 exposes list_profiles as list-profiles
+args = [a if a.startswith('-') or a in theo.commands else a.replace('_', '-')
+        for a in sys.argv[1:]]
+try:
+    theo.main(args, prog_name='theo', standalone_mode=False)
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps({'imports': len(sys.modules) - baseline}))
+'''
+
+SETTINGS = {
+    'staging': {
+        'aws_profile_name': 'default',
+        'aws_region_name': 'us-east-1',
+        'cluster': 'staging'
+    }
+}
+
+
+def run_once(args, cwd):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', CHILD] + args, cwd=cwd,
+                            env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    elapsed = time.time() - start
+    if proc.returncode != 0:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+    report = json.loads(err.decode('utf-8').strip().splitlines()[-1])
+    report['wall'] = elapsed
+    return report
+
+
+def bench(args, runs, cwd):
+    samples = [run_once(args, cwd) for _ in range(runs)]
+    walls = sorted(i['wall'] for i in samples)
+    return {
+        'command': 'theo ' + ' '.join(args),
+        'runs': runs,
+        'wall_min': walls[0],
+        'wall_median': walls[len(walls) // 2],
+        'imports': samples[-1]['imports'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--json', action='store_true',
+                        help='Print machine-readable results')
+    opts = parser.parse_args()
+
+    cwd = tempfile.mkdtemp(prefix='theo-bench-')
+    try:
+        with open(os.path.join(cwd, '.theo'), 'w') as f:
+            json.dump(SETTINGS, f)
+        results = [bench(args, opts.runs, cwd) for args in COMMANDS]
+    finally:
+        shutil.rmtree(cwd)
+
+    if opts.json:
+        print(json.dumps(results, indent=4))
+        return
+    for r in results:
+        print('{command:<24} median {wall_median:.3f}s  min {wall_min:.3f}s  '
+              'imports {imports}'.format(**r))
+
+
+if __name__ == '__main__':
+    main()
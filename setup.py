@@ -3,16 +3,18 @@ from setuptools import setup
 setup(
     name='theo',
     version='0.1',
-    py_modules=['theo.cli'],
+    packages=['theo'],
+    package_data={'theo': ['cloudformation/*.json']},
     install_requires=[
         'Click',
         'unipath',
         'docker-py',
         'terminaltables',
         'boto3',
+        'futures; python_version < "3"',
     ],
     entry_points='''
         [console_scripts]
-        theo=theo.cli:theo
+        theo=theo.client:main
     ''',
 )
\ No newline at end of file
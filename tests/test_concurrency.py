@@ -0,0 +1,44 @@
+import threading
+import time
+import unittest
+
+from theo.concurrency import TimeoutError, fan_out
+
+
+class FanOutTest(unittest.TestCase):
+    def test_stuck_workers_are_replaced(self):
+        release = threading.Event()
+
+        def func(target):
+            if target < 2:
+                release.wait(10)
+            return target
+
+        begin = time.time()
+        try:
+            results = dict((target, (result, error)) for target, result, error
+                           in fan_out(func, range(5), max_workers=2,
+                                      timeout=0.5))
+        finally:
+            release.set()
+        self.assertLess(time.time() - begin, 3)
+        for target in (0, 1):
+            self.assertIsInstance(results[target][1], TimeoutError)
+        for target in (2, 3, 4):
+            self.assertEqual(results[target], (target, None))
+
+    def test_errors_are_yielded(self):
+        def func(target):
+            if target == 1:
+                raise ValueError(target)
+            return target * 2
+
+        results = dict((target, (result, error)) for target, result, error
+                       in fan_out(func, range(3), max_workers=2))
+        self.assertEqual(results[0], (0, None))
+        self.assertIsInstance(results[1][1], ValueError)
+        self.assertEqual(results[2], (4, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+import botocore.exceptions
+from botocore.validate import validate_parameters
+
+from theo.deploy import DeployEngine, RolloutError, clean_task_definition, \
+    register_task_definition_shape
+from theo.theo import Theo
+from theo.utils import ComposeECS
+
+COMPOSE = """
+version: '3'
+services:
+  web:
+    image: web:latest
+    build: .
+    restart: always
+    mem_limit: 512m
+    ports:
+      - "8080:80"
+      - "443"
+    environment:
+      DEBUG: 1
+    labels:
+      tier: web
+    depends_on:
+      - cache
+  cache:
+    image: redis:5
+    restart: unless-stopped
+    depends_on:
+      db:
+        condition: service_healthy
+  db:
+    image: postgres:11
+    environment:
+      - POSTGRES_DB=app
+"""
+
+
+class CleanTaskDefinitionTest(unittest.TestCase):
+    def render(self):
+        directory = tempfile.mkdtemp()
+        file_path = os.path.join(directory, 'docker-compose.yml')
+        with open(file_path, 'w') as f:
+            f.write(COMPOSE)
+        theo_ins = Theo()
+        theo_ins.settings = {'aws_profile_name': None,
+                             'aws_region_name': 'us-east-1'}
+        return ComposeECS(theo_ins, 'app', file_path, compose_cache=None,
+                          secrets=None).render()
+
+    def test_render_validates(self):
+        # Raises ParamValidationError on any invalid parameter
+        validate_parameters(clean_task_definition(self.render()),
+                            register_task_definition_shape())
+
+    def test_translations(self):
+        containers = dict(
+            (i['name'], i) for i in
+            clean_task_definition(self.render())['containerDefinitions'])
+        web = containers['web']
+        self.assertEqual(web['memory'], 512)
+        self.assertEqual(web['portMappings'][0],
+                         {'hostPort': 8080, 'containerPort': 80,
+                          'protocol': 'tcp'})
+        self.assertEqual(web['dependsOn'],
+                         [{'containerName': 'cache', 'condition': 'START'}])
+        self.assertEqual(web['environment'], [{'name': 'DEBUG',
+                                               'value': '1'}])
+        self.assertNotIn('build', web)
+        self.assertNotIn('restart', web)
+        self.assertEqual(containers['cache']['dependsOn'],
+                         [{'containerName': 'db', 'condition': 'HEALTHY'}])
+        self.assertEqual(containers['db']['environment'],
+                         [{'name': 'POSTGRES_DB', 'value': 'app'}])
+
+
+class MissingServiceECS(object):
+    def update_service(self, **kwargs):
+        raise botocore.exceptions.ClientError(
+            {'Error': {'Code': 'ServiceNotFoundException',
+                       'Message': 'Service not found.'}}, 'UpdateService')
+
+
+class DeployEngineTest(unittest.TestCase):
+    def test_refused_update_fails_the_service(self):
+        theo_ins = Theo()
+        theo_ins.client = lambda name: MissingServiceECS()
+        events = []
+        with self.assertRaises(RolloutError):
+            for event in DeployEngine(theo_ins, 'app').run(
+                    {'web': 'arn:task-definition/web:2'}):
+                events.append(event)
+        self.assertEqual(events, [{
+            'service': 'web', 'state': 'failed',
+            'message': 'ServiceNotFoundException: Service not found.'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from theo.inventory import REFRESH, Inventory, InventoryStore
+
+
+class FakeTheo(object):
+    def __init__(self, names):
+        self.names = names
+        self.describes = 0
+
+    def iter_task_arns(self, cluster, aws_profile_name=None):
+        for name in self.names:
+            yield 'arn/' + name
+
+    def describe_tasks(self, cluster, task_arns, aws_profile_name=None):
+        self.describes += 1
+        return [{'taskArn': arn, 'lastStatus': 'RUNNING',
+                 'group': 'service:web',
+                 'taskDefinitionArn': 'arn:task-definition/web:1'}
+                for arn in task_arns]
+
+    def iter_clusters(self, aws_profile_name=None, region_name=None):
+        for name in self.names:
+            yield {'clusterArn': 'arn/' + name, 'clusterName': name}
+
+
+class InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = InventoryStore(os.path.join(self.directory,
+                                                 'inventory.sqlite'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_tasks_stream_while_refreshing(self):
+        theo_ins = FakeTheo(['{0:04d}'.format(i) for i in range(1000)])
+        inventory = Inventory(theo_ins, self.store, max_workers=1)
+        tasks = inventory.tasks('bench')
+        next(tasks)
+        self.assertLess(theo_ins.describes, 10)
+        self.assertEqual(sum(1 for _ in tasks), 999)
+        self.assertEqual(theo_ins.describes, 10)
+
+    def test_refresh_forgets_vanished(self):
+        theo_ins = FakeTheo(['a', 'b', 'c'])
+        inventory = Inventory(theo_ins, self.store)
+        self.assertEqual(len(list(inventory.tasks('bench'))), 3)
+        self.assertEqual(len(list(inventory.clusters())), 3)
+        theo_ins.names = ['c', 'd']
+        self.assertEqual(
+            sorted(i['taskArn'] for i in inventory.tasks('bench',
+                                                         mode=REFRESH)),
+            ['arn/c', 'arn/d'])
+        self.assertEqual(sorted(self.store.task_statuses(None, None,
+                                                         'bench')),
+                         ['arn/c', 'arn/d'])
+        self.assertEqual(
+            [i['clusterName'] for i in inventory.clusters(mode=REFRESH)],
+            ['c', 'd'])
+        self.assertEqual([i['clusterName'] for i in inventory.clusters()],
+                         ['c', 'd'])
+        self.assertEqual(len(list(inventory.tasks('bench',
+                                                  service='other',
+                                                  mode=REFRESH))), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+asyncio front end of Theo, for embedding theo in asyncio applications.
+
+Theo stays synchronous: AsyncTheo runs its methods on a thread pool and
+awaits them, so the boto3 clients, their connection pools and the shared
+rate limiter are the same for sync and async callers. Requires Python 3.6+.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .theo import Theo
+
+DEFAULT_MAX_CONCURRENCY = 100
+# Items pulled from a paginated listing per trip to the thread pool
+_CHUNK = 100
+
+
+class AsyncTheo(object):
+    """
+    :param theo_ins: The Theo to drive, a new one by default
+    :param max_concurrency: Calls running at the same time. Callers above
+    that wait for a slot, so one loop can issue hundreds of queries without
+    opening hundreds of threads and connections.
+    :param timeout: Default seconds a call may take, None for no limit
+
+    Cancelling a call, or its timeout expiring, abandons the blocking call
+    it is waiting for: listings stop between pages, a single AWS request
+    that already went out runs to completion in its thread.
+    """
+
+    def __init__(self, theo_ins=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 timeout=None):
+        self.theo = theo_ins or Theo(max_pool_connections=max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_concurrency)
+        self._semaphores = {}
+
+    def _semaphore(self):
+        # asyncio primitives belong to one loop, keep one per loop
+        loop = asyncio.get_event_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) on the thread pool, e.g. any Theo
+        method without an async counterpart
+        :param timeout: Keyword only, overrides the default timeout
+        :raises asyncio.TimeoutError: When the timeout expires
+        """
+        timeout = kwargs.pop('timeout', self.timeout)
+        loop = asyncio.get_event_loop()
+        async with self._semaphore():
+            future = loop.run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs))
+            return await asyncio.wait_for(future, timeout)
+
+    async def iterate(self, iterable_func, *args, **kwargs):
+        """
+        Async generator over the items of a blocking iterator such as
+        Theo.iter_tasks, pulled in chunks on the thread pool. The iterator
+        is closed when the consumer stops or is cancelled.
+        """
+        iterator = iter(await self.run(iterable_func, *args, **kwargs))
+        # A cancelled pull keeps running in its thread, close() must wait
+        # for it or the generator raises 'already executing'
+        lock = threading.Lock()
+
+        def pull():
+            chunk = []
+            with lock:
+                for item in iterator:
+                    chunk.append(item)
+                    if len(chunk) >= _CHUNK:
+                        break
+            return chunk
+
+        def close():
+            with lock:
+                getattr(iterator, 'close', lambda: None)()
+
+        try:
+            while True:
+                chunk = await self.run(pull)
+                if not chunk:
+                    return
+                for item in chunk:
+                    yield item
+        finally:
+            await asyncio.shield(self.run(close, timeout=None))
+
+    async def _collect(self, iterable_func, *args, **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+
+        async def collect():
+            return [i async for i in self.iterate(iterable_func, *args,
+                                                  **kwargs)]
+
+        return await asyncio.wait_for(collect(), timeout)
+
+    async def list_clusters(self, aws_profile_name=None, region_name=None,
+                            timeout=None):
+        """
+        :return: List of cluster ARNs
+        """
+        return await self._collect(
+            self.theo.iter_cluster_arns, aws_profile_name, region_name,
+            timeout=timeout or self.timeout)
+
+    async def list_tasks(self, cluster, aws_profile_name=None,
+                         desired_status=None, service_name=None,
+                         timeout=None):
+        """
+        :return: List of task ARNs
+        """
+        return await self._collect(
+            self.theo.iter_task_arns, cluster, aws_profile_name,
+            desired_status, service_name, timeout=timeout or self.timeout)
+
+    def iter_tasks(self, cluster, aws_profile_name=None, desired_status=None,
+                   service_name=None):
+        """
+        :return: Async generator of described task dicts
+        """
+        return self.iterate(self.theo.iter_tasks, cluster, aws_profile_name,
+                            desired_status, service_name)
+
+    async def list_repos(self, timeout=None):
+        return await self._collect(self.theo.iter_repos,
+                                   timeout=timeout or self.timeout)
+
+    async def get_ecr_credentials(self, registry_id, timeout=None):
+        """
+        :return: (password, registry endpoint)
+        """
+        return await self.run(self.theo.get_ecr_credentials, registry_id,
+                              timeout=timeout or self.timeout)
+
+    async def create_cluster(self, stack_name, parameters, aws_profile_name,
+                             aws_region_name, template_bucket=None,
+                             timeout=None):
+        """
+        :return: The stack ID
+        """
+        return await self.run(self.theo.create_cluster, stack_name,
+                              parameters, aws_profile_name, aws_region_name,
+                              template_bucket,
+                              timeout=timeout or self.timeout)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
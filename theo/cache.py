@@ -0,0 +1,68 @@
+import errno
+import hashlib
+import json
+import os
+import tempfile
+
+
+def cache_root():
+    """
+    Root of theo's on-disk caches, ~/.cache/theo unless THEO_CACHE_DIR or
+    XDG_CACHE_HOME say otherwise
+    """
+    if os.environ.get('THEO_CACHE_DIR'):
+        return os.environ['THEO_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'theo')
+
+
+def cache_dir(*parts):
+    """
+    A directory under cache_root(), created readable by the current user
+    only since some caches hold credentials
+    """
+    path = os.path.join(cache_root(), *parts)
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+
+def cache_key(*parts):
+    """
+    A filesystem safe key for any combination of strings
+    """
+    raw = u'\0'.join(u'{0}'.format(i) for i in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def read_json(path):
+    """
+    :return: The decoded file or None if it is missing or corrupt
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path, obj, **kwargs):
+    """
+    Write obj as JSON through a temporary file and a rename, so readers
+    never see a partially written file. The file is only readable by the
+    current user.
+    :param kwargs: Passed to json.dump, e.g. indent
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f, **kwargs)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -4,7 +4,12 @@ import os
 import click
 import terminaltables
 
-from .theo import Theo
+from .concurrency import DEFAULT_MAX_WORKERS
+from .images import format_bytes
+from .output import emit, output_option
+from .stacks import StackError
+from .theo import Theo, default_aws_profile_name
+from .trace import enable_tracing
 
 
 class TheoSettingsError(Exception):
@@ -38,6 +43,154 @@ def require_settings(func):
     return func_wrapper
 
 
+class PromptUnless(click.Option):
+    """
+    An option that only prompts when none of the options named in unless
+    were given, e.g. --aws_profile is pointless with --all_profiles.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.unless = kwargs.pop('unless')
+        super(PromptUnless, self).__init__(*args, **kwargs)
+
+    def handle_parse_result(self, ctx, opts, args):
+        prompt = self.prompt
+        if any(opts.get(name) for name in self.unless):
+            self.prompt = None
+        try:
+            return super(PromptUnless, self).handle_parse_result(
+                ctx, opts, args)
+        finally:
+            self.prompt = prompt
+
+
+def cluster_row(aws_profile, cluster):
+    return [
+        aws_profile,
+        cluster['clusterArn'].split(':')[3],
+        cluster['clusterName'],
+        cluster.get('status', ''),
+        cluster.get('runningTasksCount', 0),
+        cluster.get('pendingTasksCount', 0),
+        cluster.get('registeredContainerInstancesCount', 0),
+        cluster.get('activeServicesCount', 0),
+    ]
+
+
+def push_job(spec, tags, buildargs=None):
+    """
+    Parse an IMAGE argument of push_image, image[=repository]. The
+    repository defaults to the image name without its tag.
+    """
+    source, _, repository = spec.partition('=')
+    if os.path.isfile(source):
+        job = {'file_path': source, 'buildargs': buildargs}
+        repository = repository or os.path.basename(
+            os.path.dirname(os.path.abspath(source)))
+    else:
+        job = {'prebuilt_image_name': source}
+        repository = repository or source.rsplit(':', 1)[0]
+    job['repository'] = repository
+    job['tags'] = list(tags)
+    return job
+
+
+def task_row(task):
+    started = task.get('startedAt') or ''
+    return [
+        task['taskArn'],
+        task.get('lastStatus', ''),
+        task.get('taskDefinitionArn', '').split('/')[-1],
+        task.get('containerInstanceArn', '').split('/')[-1],
+        # Tasks from the inventory carry the ISO 8601 string already
+        started.isoformat() if hasattr(started, 'isoformat') else started,
+    ]
+
+
+def service_row(service):
+    deployments = service.get('deployments', [])
+    return [
+        service['serviceName'],
+        service.get('status', ''),
+        service.get('desiredCount', 0),
+        service.get('runningCount', 0),
+        service.get('pendingCount', 0),
+        service.get('taskDefinition', '').split('/')[-1],
+        len(deployments),
+        ', '.join(i.get('rolloutState', '') for i in deployments
+                  if i.get('status') == 'PRIMARY'),
+    ]
+
+
+def echo_changes(batches, output, headers, row):
+    """
+    Print the changes of a watch.Watcher: a table of the first poll, then
+    one line per task or service that appeared, disappeared or changed,
+    naming the columns that changed. The other formats print every change
+    as a record, {"change": ..., "before": ..., "after": ...} for json and
+    jsonl, row(item) after a Change column for csv.
+    """
+    import csv
+    import datetime
+
+    from .output import dumps
+
+    signs = {'added': ('+', 'green'), 'removed': ('-', 'red'),
+             'changed': ('~', 'yellow')}
+    csv_writer = None
+    if output == 'csv':
+        csv_writer = csv.writer(click.get_text_stream('stdout'),
+                                lineterminator='\n')
+        csv_writer.writerow(['Change'] + headers)
+    first = True
+    for changes in batches:
+        if output == 'table' and first:
+            emit([i[2] for i in changes], output, headers, row, sort=True)
+            first = False
+            continue
+        now = datetime.datetime.now().strftime('%H:%M:%S')
+        for change, old, new in changes:
+            if csv_writer is not None:
+                csv_writer.writerow([change] + row(new or old))
+            elif output != 'table':
+                click.echo(dumps({'change': change, 'before': old,
+                                  'after': new}))
+            elif change == 'changed':
+                columns = ['{0} {1} -> {2}'.format(header, before, after)
+                           for header, before, after in
+                           zip(headers, row(old), row(new))
+                           if before != after]
+                click.echo(click.style('{0} ~ {1}: {2}'.format(
+                    now, row(new)[0], ', '.join(columns)), fg='yellow'))
+            else:
+                sign, color = signs[change]
+                click.echo(click.style('{0} {1} {2}'.format(
+                    now, sign, ' '.join(str(i) for i in row(new or old))),
+                    fg=color))
+        click.get_text_stream('stdout').flush()
+
+
+def inventory_options(func):
+    """
+    --cached and --refresh, passed to the command as inventory_mode
+    """
+    @functools.wraps(func)
+    def func_wrapper(*args, **kwargs):
+        cached, refresh = kwargs.pop('cached'), kwargs.pop('refresh')
+        kwargs['inventory_mode'] = 'refresh' if refresh else \
+            'cached' if cached else 'auto'
+        return func(*args, **kwargs)
+
+    func_wrapper = click.option(
+        '--refresh', is_flag=True,
+        help='Query AWS and update the local inventory.')(func_wrapper)
+    return click.option(
+        '--cached', is_flag=True,
+        help='Answer from the local inventory however old it is. Without '
+             'either flag the inventory is used while it is recent.')(
+        func_wrapper)
+
+
 #######################################
 #
 #  Theo Commands
@@ -45,77 +198,289 @@ def require_settings(func):
 #######################################
 
 
+def echo_trace_summary(tracer):
+    table_data = [['Call', 'Calls', 'Errors', 'Retries', 'Throttled',
+                   'Total', 'Mean', 'Max', 'In', 'Out']]
+    for row in tracer.summary():
+        table_data.append([
+            '{0} {1}'.format(row['category'], row['name']),
+            row['calls'],
+            row['errors'],
+            row['retries'],
+            row['throttles'],
+            '{0:.3f}s'.format(row['total']),
+            '{0:.3f}s'.format(row['mean']),
+            '{0:.3f}s'.format(row['max']),
+            format_bytes(row['bytes_in']),
+            format_bytes(row['bytes_out']),
+        ])
+    click.echo(terminaltables.AsciiTable(table_data).table, err=True)
+
+
 @click.group()
+@click.option('--trace', is_flag=True,
+              help='Print the time spent in AWS and docker calls at exit.')
+@click.option('--trace_file', default=None,
+              help='Also write the calls to this file in the Chrome trace '
+                   'format, for chrome://tracing or Perfetto.')
 @click.pass_context
-def theo(ctx):
+def theo(ctx, trace, trace_file):
     ctx.obj = {}
+    if trace or trace_file:
+        # Must happen before the first boto3 session is created
+        tracer = enable_tracing()
+
+        def report():
+            echo_trace_summary(tracer)
+            if trace_file:
+                tracer.write_chrome_trace(trace_file)
+
+        ctx.call_on_close(report)
+    # Theo() is lazy, nothing is loaded until a command uses it
     ctx.obj['theo'] = Theo()
 
 
 @theo.command()
-@click.option('--aws_profile', prompt=True, default=Theo().boto_session.profile_name)
+@click.option('--aws_profile', cls=PromptUnless,
+              unless=['all_profiles'], prompt=True,
+              default=default_aws_profile_name)
+@click.option('--all_profiles', is_flag=True,
+              help='Query every profile found in ~/.aws/credentials.')
+@click.option('--regions', default=None,
+              help='Comma separated AWS region names ex. us-east-1,eu-west-1')
+@click.option('--workers', default=DEFAULT_MAX_WORKERS,
+              help='Number of (profile, region) pairs queried at once.')
+@click.option('--timeout', default=60.0,
+              help='Seconds to wait for a single (profile, region) pair.')
+@inventory_options
+@output_option
 @click.pass_context
-def list_clusters(ctx, aws_profile):
+def list_clusters(ctx, aws_profile, all_profiles, regions, workers, timeout,
+                  inventory_mode, output):
     theo_ins = ctx.obj['theo']
-    result = theo_ins.list_clusters(aws_profile)
-    click.echo(click.style('List of Amazon ECS Clusters (ARNs):', fg='green'))
-    table_data = [[i] for i in result]
-    table_data.insert(0, ['ARN'])
-    click.echo(terminaltables.AsciiTable(table_data).table)
+    profiles = [aws_profile]
+    if all_profiles:
+        profiles = theo_ins.available_aws_profiles()
+    region_names = regions.split(',') if regions else [None]
+    targets = [(p, r) for p in profiles for r in region_names]
+
+    def records():
+        for target, clusters, error in theo_ins.inventory.fan_out_clusters(
+                targets, inventory_mode, workers, timeout):
+            label = '{0} {1}'.format(target[0],
+                                     target[1] or '(default region)')
+            if error is not None:
+                click.echo(click.style('{0}: {1}'.format(label, error),
+                                       fg='red'), err=True)
+                continue
+            click.echo('{0}: {1} clusters'.format(label, len(clusters)),
+                       err=True)
+            for cluster in clusters:
+                yield dict(cluster, awsProfile=target[0])
+
+    emit(records(), output,
+         ['Profile', 'Region', 'Name', 'Status', 'Running', 'Pending',
+          'Instances', 'Services'],
+         lambda i: cluster_row(i['awsProfile'], i),
+         title='List of Amazon ECS Clusters:', sort=True)
+
+
+def cluster_template_options(func):
+    """
+    The options shared by the commands working on Theo's CloudFormation
+    ECS template
+    """
+    options = [
+        click.argument('stack_name'),
+        click.option('--key_name', prompt=True, help='EC2 Key Pair'),
+        click.option('--security_group_id',
+                     prompt=True, help='EC2 Security Group ID ex. sg-xxxxxxxx'),
+        click.option('--subnet_id', prompt=True,
+                     help='VPC subnet ID ex. subnet-xxxxxxxx'),
+        click.option('--desired_capacity', prompt=True,
+                     help='Number of EC2 instances', default='2'),
+        click.option('--autoscaling_max_size', prompt=True,
+                     help='Maximum number of EC2 instances', default='10'),
+        click.option('--instance_type', prompt=True, help='EC2 Instance Type',
+                     default='t2.micro'),
+        click.option('--aws_profile', prompt=True,
+                     default=default_aws_profile_name),
+        click.option('--aws_region_name', default='us-east-1', prompt=True,
+                     help="The AWS region name."),
+        click.option('--template_bucket', default=None,
+                     help='S3 bucket to upload the template to when it is '
+                          'too big to send inline.'),
+        click.option('--wait', is_flag=True,
+                     help='Stream the stack events until it settles.'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def template_parameters(kwargs):
+    template_param_keys = ['key_name', 'security_group_id', 'subnet_id',
+                           'desired_capacity', 'instance_type', 'autoscaling_max_size']
+    return [
+        {'ParameterKey': k.replace('_', ''),
+         'ParameterValue': v} for k, v in kwargs.items() if k in template_param_keys
+        ]
+
+
+def echo_stack_events(events):
+    try:
+        for event in events:
+            status = event['ResourceStatus']
+            color = 'red' if 'FAILED' in status or 'ROLLBACK' in status \
+                else 'green' if status.endswith('_COMPLETE') else None
+            click.echo(click.style('{0} {1} {2} {3}'.format(
+                event['Timestamp'].strftime('%H:%M:%S'), status,
+                event['LogicalResourceId'],
+                event.get('ResourceStatusReason', '')), fg=color))
+    except StackError as e:
+        click.echo(click.style(str(e), fg='red'))
+        exit(1)
 
 
 @theo.command(
     help="Create a AWS Cloudformation ECS stack using Theo's default template."
 )
-@click.argument('stack_name')
-@click.option('--key_name', prompt=True, help='EC2 Key Pair')
-@click.option('--security_group_id',
-              prompt=True, help='EC2 Security Group ID ex. sg-xxxxxxxx')
-@click.option('--subnet_id', prompt=True,
-              help='VPC subnet ID ex. subnet-xxxxxxxx')
-@click.option('--desired_capacity', prompt=True,
-              help='Number of EC2 instances', default='2')
-@click.option('--autoscaling_max_size', prompt=True,
-              help='Maximum number of EC2 instances', default='10')
-@click.option('--instance_type', prompt=True, help='EC2 Instance Type',
-              default='t2.micro')
-@click.option('--aws_profile', prompt=True,
-              default=Theo().boto_session.profile_name)
-@click.option('--aws_region_name', default='us-east-1', prompt=True,
-              help="The AWS region name.")
+@cluster_template_options
 @click.pass_context
 def create_cluster(ctx, stack_name, **kwargs):
-    template_param_keys = ['key_name', 'security_group_id', 'subnet_id',
-                           'desired_capacity', 'instance_type', 'autoscaling_max_size']
-    parameters = [
-        {'ParameterKey': k.replace('_', ''),
-         'ParameterValue': v} for k, v in kwargs.items() if k in template_param_keys
-        ]
+    parameters = template_parameters(kwargs)
     theo_ins = ctx.obj['theo']
 
     result = theo_ins.create_cluster(stack_name, parameters,
-                                     kwargs['aws_profile'], kwargs['aws_region_name'])
+                                     kwargs['aws_profile'], kwargs['aws_region_name'],
+                                     kwargs['template_bucket'])
 
     click.echo(click.style(
         'Here is the ARN for your new cloudformation stack: {0}'.format(
             result), fg='green'))
+    if kwargs['wait']:
+        echo_stack_events(theo_ins.stack_events(
+            stack_name, kwargs['aws_profile'], kwargs['aws_region_name']))
+
+
+@theo.command(
+    help="Update a stack created by create_cluster to Theo's current "
+         "template. Shows the change set and asks before executing it."
+)
+@cluster_template_options
+@click.option('--yes', is_flag=True, help='Execute without asking.')
+@click.pass_context
+def update_cluster(ctx, stack_name, yes, **kwargs):
+    parameters = template_parameters(kwargs)
+    theo_ins = ctx.obj['theo']
+    profile, region = kwargs['aws_profile'], kwargs['aws_region_name']
+
+    change_set_id, changes = theo_ins.plan_cluster_update(
+        stack_name, parameters, profile, region, kwargs['template_bucket'])
+    if change_set_id is None:
+        click.echo(click.style('{0} is up to date.'.format(stack_name),
+                               fg='green'))
+        return
+
+    table_data = [[
+        i['ResourceChange']['Action'],
+        i['ResourceChange']['LogicalResourceId'],
+        i['ResourceChange']['ResourceType'],
+        i['ResourceChange'].get('Replacement', ''),
+    ] for i in changes]
+    table_data.insert(0, ['Action', 'Resource', 'Type', 'Replacement'])
+    click.echo(terminaltables.AsciiTable(table_data).table)
+    if not yes and not click.confirm('Execute this change set?'):
+        return
+
+    theo_ins.execute_change_set(change_set_id, profile, region)
+    click.echo(click.style('Executing {0}'.format(change_set_id), fg='green'))
+    if kwargs['wait']:
+        echo_stack_events(theo_ins.stack_events(
+            stack_name, profile, region, skip_existing=True))
 
 
 @theo.command(help='Ex: theo clusters list_services <cluster_id>')
-@click.option('--aws_profile', prompt=True, default=Theo().boto_session.profile_name)
+@click.option('--aws_profile', prompt=True, default=default_aws_profile_name)
 @click.option('--cluster', prompt=True,
               help='The Amazon ARN for the cluster that you want a list of ' \
                    'tasks from. ex. arn:aws:ecs:us-east-1:5354534534534:cluster/test')
+@click.option('--status', default=None,
+              type=click.Choice(['RUNNING', 'PENDING', 'STOPPED']),
+              help='Only list tasks with this desired status.')
+@click.option('--service', default=None,
+              help='Only list tasks that belong to this ECS service.')
+@click.option('--family', default=None,
+              help='Only list tasks of this task definition family.')
+@click.option('--workers', default=DEFAULT_MAX_WORKERS,
+              help='Number of concurrent describe_tasks calls.')
+@click.option('--watch', is_flag=True,
+              help='Keep polling and print only the tasks that appear, '
+                   'disappear or change, until interrupted.')
+@inventory_options
+@output_option
 @click.pass_context
-def list_tasks(ctx, aws_profile, cluster):
+def list_tasks(ctx, aws_profile, cluster, status, service, family, workers,
+               watch, inventory_mode, output):
     theo_ins = ctx.obj['theo']
-    result = theo_ins.list_tasks(aws_profile, cluster)
-    click.echo(click.style(
-        'List of Amazon ECS Task Definitions (ARNs) for' \
-        ' the cluster specified:', fg='green'))
-    table_data = [[i] for i in result]
-    table_data.insert(0, ['ARN'])
-    click.echo(terminaltables.AsciiTable(table_data).table)
+    headers = ['ARN', 'Status', 'Task Definition', 'Container Instance',
+               'Started']
+    if watch:
+        from .watch import TaskWatcher
+
+        watcher = TaskWatcher(theo_ins, cluster, aws_profile, status,
+                              service, family, max_workers=workers)
+        try:
+            echo_changes(watcher.watch(), output, headers, task_row)
+        except KeyboardInterrupt:
+            pass
+        return
+    if status in (None, 'RUNNING'):
+        theo_ins.inventory.max_workers = workers
+        result = theo_ins.inventory.tasks(cluster, aws_profile, service,
+                                          family=family, mode=inventory_mode)
+    else:
+        # The inventory only holds the tasks that are meant to be running
+        result = theo_ins.iter_tasks(cluster, aws_profile,
+                                     desired_status=status,
+                                     service_name=service,
+                                     max_workers=workers)
+        if family:
+            from .inventory import task_family
+
+            result = (i for i in result if task_family(i) == family)
+    emit(result, output, headers, task_row,
+         title='List of Amazon ECS Tasks for the cluster specified:')
+
+
+@theo.command()
+@click.option('--aws_profile', prompt=True, default=default_aws_profile_name)
+@click.option('--cluster', prompt=True,
+              help='The name or ARN of the cluster to list the services of.')
+@click.option('--workers', default=DEFAULT_MAX_WORKERS,
+              help='Number of concurrent describe_services calls.')
+@click.option('--watch', is_flag=True,
+              help='Keep polling and print only the services that appear, '
+                   'disappear or change, until interrupted.')
+@output_option
+@click.pass_context
+def list_services(ctx, aws_profile, cluster, workers, watch, output):
+    theo_ins = ctx.obj['theo']
+    headers = ['Name', 'Status', 'Desired', 'Running', 'Pending',
+               'Task Definition', 'Deployments', 'Rollout']
+    if watch:
+        from .watch import ServiceWatcher
+
+        watcher = ServiceWatcher(theo_ins, cluster, aws_profile,
+                                 max_workers=workers)
+        try:
+            echo_changes(watcher.watch(), output, headers, service_row)
+        except KeyboardInterrupt:
+            pass
+        return
+    emit(theo_ins.iter_services(cluster, aws_profile, workers), output,
+         headers, service_row, title='List of Amazon ECS Services:',
+         sort=True)
 
 
 @theo.command()
@@ -129,12 +494,16 @@ def list_tasks(ctx, aws_profile, cluster):
               help='The ECS cluster this profile should interact with')
 @click.option('--env_file', prompt=True,default='',
               help='Environment variables file ex: s3://mybucketname:path/to/my/settings.py')
+@click.option('--execution_role_arn', default='',
+              help='Task execution role of the task definitions, needed '
+                   'for ECS secrets.')
 @click.pass_context
 def start_project(ctx, profile_name, aws_profile_name, aws_region_name,
-                  cluster, env_file):
+                  cluster, env_file, execution_role_arn):
     theo_ins = ctx.obj['theo']
     theo_ins.start_project(profile_name, aws_profile_name,
-                           aws_region_name, cluster, env_file)
+                           aws_region_name, cluster, env_file,
+                           execution_role_arn)
     click.echo(click.style(
         'Created .theo settings with an intial profile named {0}.'.format(
             profile_name), fg='green'))
@@ -151,37 +520,297 @@ def start_project(ctx, profile_name, aws_profile_name, aws_region_name,
               help='The ECS cluster this profile should interact with')
 @click.option('--env_file', prompt=True,default='',
               help='Environment variables file ex: s3://mybucketname:path/to/my/settings.py')
+@click.option('--execution_role_arn', default='',
+              help='Task execution role of the task definitions, needed '
+                   'for ECS secrets.')
 @click.pass_context
 @require_settings
-def add_profile(ctx, profile_name, aws_profile_name, aws_region_name, cluster, env_file):
+def add_profile(ctx, profile_name, aws_profile_name, aws_region_name, cluster, env_file,
+                execution_role_arn):
     theo_ins = ctx.obj['theo']
     resp = theo_ins.add_profile(profile_name, aws_profile_name,
-                                aws_region_name, cluster, env_file)
+                                aws_region_name, cluster, env_file,
+                                execution_role_arn)
     click.echo(click.style('Updated .theo settings with a new profile ' \
                            'named {0}. Current profiles: {1}'.format(
         profile_name, list(resp.keys())), fg='green'))
 
 
 @theo.command()
+@output_option
 @click.pass_context
 @require_settings
-def list_profiles(ctx):
+def list_profiles(ctx, output):
     theo_ins = ctx.obj['theo']
-    result = theo_ins.list_profiles()
-    click.echo(click.style('List of Theo profiles:', fg='green'))
-    table_data = [[i] for i in result]
-    table_data.insert(0, ['Profile Name'])
-    click.echo(terminaltables.AsciiTable(table_data).table)
+    result = (dict(settings, profile_name=name) for name, settings in
+              theo_ins.settings_store.load().items())
+    emit(result, output, ['Profile Name'], lambda i: [i['profile_name']],
+         title='List of Theo profiles:')
+
+
+@theo.command(help='Register the task definitions of compose files that '
+                   'changed since the last deploy and update their services. '
+                   'Ex: theo deploy staging web/docker-compose.yml')
+@click.argument('profile_name')
+@click.argument('compose_files', nargs=-1, required=True)
+@click.option('--service', 'services', multiple=True,
+              help='FAMILY=SERVICE, the ECS service to update for a family. '
+                   'Defaults to the service named like the family, which is '
+                   "the compose file's directory name.")
+@click.option('--trust_index', is_flag=True,
+              help='Skip families whose render matches the local deploy '
+                   'index without asking ECS.')
+@click.option('--wait', is_flag=True,
+              help='Roll the services out concurrently and wait until they '
+                   'are stable.')
+@click.option('--after', multiple=True,
+              help='SERVICE=DEPENDENCY, only start SERVICE once DEPENDENCY '
+                   'is stable. Implies --wait.')
+@click.option('--concurrency', default=5,
+              help='Number of services rolling out at once with --wait.')
+@click.option('--secrets', type=click.Choice(['ecs', 'inline']),
+              default='ecs',
+              help='ecs registers ssm: and secretsmanager: environment '
+                   'values as ECS secrets, which needs a task execution role '
+                   'allowed to read them. inline resolves them into the '
+                   'task definition in plain text.')
+@click.option('--execution_role', default=None,
+              help='Task execution role ARN, defaults to execution_role_arn '
+                   'of the profile.')
+@click.pass_context
+@require_settings
+def deploy(ctx, profile_name, compose_files, services, trust_index, wait,
+           after, concurrency, secrets, execution_role):
+    from .deploy import DeployEngine, RolloutError, TaskDefinitionDeployer, \
+        family_name
+    from .secrets import SecretError
+    from .utils import ComposeECS
 
+    theo_ins = ctx.obj['theo']
+    load_settings(theo_ins, profile_name)
+    service_map = {}
+    for i in services:
+        family, _, service = i.partition('=')
+        service_map.setdefault(family, []).append(service)
 
-def deploy(ctx, profile_name):
-    pass
+    try:
+        task_definitions = [
+            ComposeECS(theo_ins, family_name(i), i, secrets=secrets,
+                       execution_role_arn=execution_role).render()
+            for i in compose_files
+        ]
+    except SecretError as e:
+        click.echo(click.style(str(e), fg='red'))
+        exit(1)
+    cluster = theo_ins.settings['cluster']
+    deployer = TaskDefinitionDeployer(theo_ins)
+    if not (wait or after):
+        try:
+            plan = deployer.deploy(task_definitions, cluster, service_map,
+                                   verify=not trust_index)
+        except RolloutError as e:
+            click.echo(click.style('Deploy failed: {0}'.format(e), fg='red'))
+            exit(1)
+        for entry in plan:
+            if not entry['changed']:
+                click.echo('{0}: unchanged ({1})'.format(
+                    entry['family'], entry['taskDefinitionArn']))
+                continue
+            click.echo(click.style('{0}: registered {1}, updated {2}'.format(
+                entry['family'], entry['taskDefinitionArn'],
+                ', '.join(entry['services'])), fg='green'))
+        return
+
+    plan = deployer.register_changed(task_definitions, service_map,
+                                     verify=not trust_index)
+    updates = {}
+    for entry in plan:
+        if not entry['changed']:
+            click.echo('{0}: unchanged ({1})'.format(
+                entry['family'], entry['taskDefinitionArn']))
+        for service in entry['services']:
+            updates[service] = entry['taskDefinitionArn']
+    dependencies = {}
+    for i in after:
+        service, _, dependency = i.partition('=')
+        dependencies.setdefault(service, []).append(dependency)
+
+    colors = {'stable': 'green', 'failed': 'red'}
+    engine = DeployEngine(theo_ins, cluster, max_concurrency=concurrency)
+    try:
+        for event in engine.run(updates, dependencies):
+            click.echo(click.style('{service}: {state} {message}'.format(
+                **event), fg=colors.get(event['state'])))
+    except RolloutError as e:
+        click.echo(click.style('Deploy failed: {0}'.format(e), fg='red'))
+        exit(1)
 
 
 def update(ctx, profile_name):
     pass
 
 
+@theo.command(help='Render the task definitions of compose files for one or '
+                   'more profiles into OUTPUT_DIR/<profile>/<family>.json, '
+                   'rendering on a process pool. Files whose task '
+                   'definition did not change are left untouched. '
+                   'Ex: theo render --all */docker-compose.yml')
+@click.argument('compose_files', nargs=-1, required=True)
+@click.option('--profile', 'profiles', multiple=True,
+              help='The theo profile to render for, can be repeated.')
+@click.option('--all', 'all_profiles', is_flag=True,
+              help='Render for every profile in .theo.')
+@click.option('--output_dir', default='rendered',
+              help='Directory the task definitions are written to.')
+@click.option('--workers', default=None, type=int,
+              help='Number of render processes, defaults to the number of '
+                   'CPUs.')
+@click.option('--secrets', type=click.Choice(['ecs', 'inline', 'none']),
+              default='ecs',
+              help='ecs turns ssm: and secretsmanager: environment values '
+                   'into ECS secrets, inline writes their values into the '
+                   'files, none leaves them as they are.')
+@click.option('--execution_role', default=None,
+              help='Task execution role ARN, defaults to execution_role_arn '
+                   'of each profile.')
+@click.pass_context
+@require_settings
+def render(ctx, compose_files, profiles, all_profiles, output_dir, workers,
+           secrets, execution_role):
+    from .render import BatchRenderer, RenderError
+
+    theo_ins = ctx.obj['theo']
+    if all_profiles:
+        profiles = list(theo_ins.settings_store.load().keys())
+    if not profiles:
+        raise click.UsageError('Give at least one --profile, or --all')
+    renderer = BatchRenderer(output_dir,
+                             None if secrets == 'none' else secrets, workers,
+                             execution_role)
+    counts = {'changed': 0, 'unchanged': 0, 'failed': 0}
+    try:
+        for result in renderer.run(compose_files, profiles):
+            label = '{0} {1}'.format(result['profile'], result['family'])
+            if 'error' in result:
+                counts['failed'] += 1
+                click.echo(click.style('{0}: {1}'.format(
+                    label, result['error']), fg='red'))
+            elif result['changed']:
+                counts['changed'] += 1
+                click.echo(click.style('{0}: wrote {1}'.format(
+                    label, result['path']), fg='green'))
+            else:
+                counts['unchanged'] += 1
+                click.echo('{0}: unchanged'.format(label))
+    except RenderError as e:
+        click.echo(click.style(str(e), fg='red'))
+        exit(1)
+    click.echo('{changed} written, {unchanged} unchanged, {failed} '
+               'failed'.format(**counts))
+    if counts['failed']:
+        exit(1)
+
+
+@theo.command(help='Print the CloudWatch logs of the tasks of an ECS service, '
+                   'merged by time. Ex: theo logs staging web --follow')
+@click.argument('profile_name')
+@click.argument('service')
+@click.option('--follow', '-f', is_flag=True,
+              help='Keep printing new events until interrupted.')
+@click.option('--since', default='10m',
+              help='How far back to start, ex. 30s, 10m, 2h, 1d.')
+@click.option('--filter', 'filter_pattern', default=None,
+              help='Only events matching this CloudWatch Logs filter '
+                   'pattern.')
+@click.option('--container', 'containers', multiple=True,
+              help='Only the logs of this container, can be repeated.')
+@click.pass_context
+@require_settings
+def logs(ctx, profile_name, service, follow, since, filter_pattern,
+         containers):
+    import datetime
+
+    from .logs import LogTailer, LogsError, parse_since, stream_label
+
+    try:
+        since = parse_since(since)
+    except ValueError:
+        raise click.BadParameter('{0!r} is not a duration'.format(since),
+                                 param_hint='--since')
+    theo_ins = ctx.obj['theo']
+    load_settings(theo_ins, profile_name)
+    tailer = LogTailer(theo_ins, theo_ins.settings['cluster'], service,
+                       containers=containers, since=since,
+                       filter_pattern=filter_pattern, follow=follow)
+    try:
+        for event in tailer.events():
+            timestamp = datetime.datetime.fromtimestamp(
+                event['timestamp'] / 1000.0)
+            click.echo('{0} {1} {2}'.format(
+                timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+                click.style(stream_label(event['logStreamName']), fg='cyan'),
+                event['message'].rstrip('\n')))
+    except LogsError as e:
+        click.echo(click.style(str(e), fg='red'))
+        exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+@theo.group(help='Keep theo warm in a background process. While it runs, '
+                 'theo commands are forwarded to it and start in '
+                 'milliseconds. Set THEO_NO_DAEMON=1 to bypass it.')
+def daemon():
+    pass
+
+
+@daemon.command('start')
+@click.option('--foreground', is_flag=True,
+              help='Do not detach, e.g. under a process supervisor.')
+@click.option('--idle_timeout', default=3600,
+              help='Exit after this many seconds without commands, 0 to '
+                   'never exit.')
+def daemon_start(foreground, idle_timeout):
+    from .cache import cache_dir
+    from .daemon import Daemon, daemonize
+
+    server = Daemon(idle_timeout=idle_timeout)
+    try:
+        server.bind()
+    except RuntimeError as e:
+        click.echo(click.style(str(e), fg='red'))
+        exit(1)
+    if not foreground:
+        if not daemonize(os.path.join(cache_dir(), 'daemon.log')):
+            server.server.close()
+            click.echo(click.style('Started the theo daemon on {0}'.format(
+                server.path), fg='green'))
+            return
+    server.serve()
+
+
+@daemon.command('stop')
+def daemon_stop():
+    from .daemon import stop
+
+    if stop():
+        click.echo(click.style('Stopped the theo daemon', fg='green'))
+    else:
+        click.echo('The theo daemon is not running')
+
+
+@daemon.command('status')
+def daemon_status():
+    from .daemon import status
+
+    state = status()
+    if state is None:
+        click.echo('The theo daemon is not running')
+        exit(1)
+    click.echo('pid {pid}, up {uptime:.0f}s, {served} commands served, '
+               '{running_commands} running, socket {socket}'.format(**state))
+
+
 #####################################
 #
 # ECR Repository Commands
@@ -198,25 +827,58 @@ def repos(ctx, profile):
     load_settings(theo_ins, profile)
 
 
-@repos.command()
+@repos.command(help='Push images to ECR. Each IMAGE is a local image name '
+                    'or a Dockerfile path, optionally followed by '
+                    '=<repository>. Ex: theo repos staging push_image '
+                    'web:latest=web worker/Dockerfile=worker')
+@click.argument('images', nargs=-1, required=True)
+@click.option('--tag', 'tags', multiple=True, default=['latest'],
+              help='Tag to push, can be given several times.')
+@click.option('--build_arg', 'build_args', multiple=True,
+              help='KEY=VALUE build arg for Dockerfile images, can be given '
+                   'several times.')
+@click.option('--workers', default=4, help='Number of concurrent pushes.')
 @click.pass_context
-def push_image(ctx):
-    pass
+def push_image(ctx, images, tags, build_args, workers):
+    theo_ins = ctx.obj['theo']
+    buildargs = dict(i.split('=', 1) for i in build_args)
+    jobs = [push_job(i, tags, buildargs) for i in images]
+    failed = False
+    for job, report, error in theo_ins.push_images(jobs, workers):
+        name = job.get('prebuilt_image_name') or job.get('file_path')
+        if error is not None:
+            failed = True
+            click.echo(click.style('{0}: {1}'.format(name, error), fg='red'))
+            continue
+        if report['skipped']:
+            click.echo(click.style(
+                '{0}: already in {1}, tagged {2}'.format(
+                    name, report['repository'], ', '.join(report['tags'])),
+                fg='green'))
+            continue
+        click.echo(click.style('{0}: pushed to {1} as {2}'.format(
+            name, report['repository'], ', '.join(report['tags'])),
+            fg='green'))
+        table_data = [[i['id'], i['status'], format_bytes(i['bytes']),
+                       '{0:.1f}s'.format(i['seconds']),
+                       format_bytes(i['rate']) + '/s']
+                      for i in report['layers']]
+        table_data.insert(0, ['Layer', 'Status', 'Size', 'Time', 'Rate'])
+        click.echo(terminaltables.AsciiTable(table_data).table)
+    if failed:
+        exit(1)
 
 
 @repos.command()
+@inventory_options
+@output_option
 @click.pass_context
-def list_repos(ctx):
+def list_repos(ctx, inventory_mode, output):
     theo_ins = ctx.obj['theo']
-    result = theo_ins.list_repos()
-    table_data = [
-        [i['registryId'], i['repositoryName'], i['repositoryArn'],
-         i['repositoryUri']]
-        for i in result
-        ]
-    table_data.insert(0, ['ID', 'Name', 'ARN', 'URL', ])
-    table = terminaltables.AsciiTable(table_data)
-    click.echo(table.table)
+    result = theo_ins.inventory.repos(inventory_mode)
+    emit(result, output, ['ID', 'Name', 'ARN', 'URL'],
+         lambda i: [i['registryId'], i['repositoryName'],
+                    i['repositoryArn'], i['repositoryUri']], sort=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,130 @@
+"""
+The theo console script. Commands are forwarded to a running theo daemon
+(see theo.daemon) and run in-process otherwise, or when THEO_NO_DAEMON is
+set. Only the standard library is imported here, so forwarding a command
+costs a few milliseconds instead of importing boto3, botocore and docker.
+"""
+import array
+import json
+import os
+import signal
+import socket
+import sys
+
+SOCKET_NAME = 'daemon.sock'
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+def socket_path():
+    """
+    THEO_DAEMON_SOCKET, or daemon.sock in theo's cache directory, which is
+    only accessible by the current user
+    """
+    if os.environ.get('THEO_DAEMON_SOCKET'):
+        return os.environ['THEO_DAEMON_SOCKET']
+    from .cache import cache_root
+
+    return os.path.join(cache_root(), SOCKET_NAME)
+
+
+def code_signature():
+    """
+    Latest modification time of theo's modules. A daemon started before
+    theo was upgraded or edited must not run its old code.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return max(os.stat(os.path.join(directory, i)).st_mtime
+               for i in os.listdir(directory) if i.endswith('.py'))
+
+
+def send_message(conn, obj):
+    conn.sendall(json.dumps(obj).encode('utf-8') + b'\n')
+
+
+def recv_message(conn, buffered=None):
+    """
+    Read one JSON line
+    :param buffered: List holding bytes received past the previous line
+    :return: The decoded object, None when the connection closed first
+    """
+    data = buffered.pop() if buffered else b''
+    while b'\n' not in data:
+        chunk = conn.recv(4096)
+        if not chunk:
+            return None
+        data += chunk
+    line, _, rest = data.partition(b'\n')
+    if buffered is not None and rest:
+        buffered.append(rest)
+    return json.loads(line.decode('utf-8'))
+
+
+def forward(argv, path=None):
+    """
+    Run a command in the daemon on this process' stdin, stdout and stderr
+    :return: The exit status of the command
+    :raises DaemonUnavailable: When no daemon could take the command, it has
+    not started then and can be run in-process
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            conn.connect(path or socket_path())
+            request = json.dumps({
+                'argv': argv,
+                'cwd': os.getcwd(),
+                'env': dict(os.environ),
+                'signature': code_signature(),
+            }).encode('utf-8') + b'\n'
+            # The descriptors go with the first bytes, sendmsg may not
+            # send a large environment at once
+            sent = conn.sendmsg([request], [(
+                socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                array.array('i', [0, 1, 2]).tobytes())])
+            conn.sendall(request[sent:])
+            buffered = []
+            started = recv_message(conn, buffered)
+        except (OSError, socket.error) as e:
+            raise DaemonUnavailable(e)
+        if started is None or 'pid' not in started:
+            raise DaemonUnavailable(started)
+
+        # The command is running, from here on it must not run again
+        try:
+            result = recv_message(conn, buffered)
+        except KeyboardInterrupt:
+            os.kill(started['pid'], signal.SIGINT)
+            result = recv_message(conn, buffered)
+        if result is None:
+            sys.stderr.write('The theo daemon exited while running the '
+                             'command\n')
+            return 1
+        return result['exit']
+    finally:
+        conn.close()
+
+
+def run_in_process(argv):
+    from .cli import theo
+
+    theo.main(args=argv, prog_name='theo')
+
+
+def main():
+    argv = sys.argv[1:]
+    if os.environ.get('THEO_NO_DAEMON') or (argv and argv[0] == 'daemon') \
+            or not hasattr(socket, 'AF_UNIX') \
+            or not hasattr(socket.socket, 'sendmsg'):
+        return run_in_process(argv)
+    try:
+        code = forward(argv)
+    except DaemonUnavailable:
+        return run_in_process(argv)
+    sys.exit(code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import threading
+
+from .ratelimit import default_rate_limiters
+from .trace import current_tracer
+
+DEFAULT_MAX_POOL_CONNECTIONS = 25
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def botocore_session():
+    """
+    A new botocore session sharing one data loader with every other session
+    of the process. The loader caches the service models it parsed, so only
+    the first client of a service pays for loading its JSON model.
+    """
+    global _loader
+    import botocore.loaders
+    import botocore.session
+
+    with _loader_lock:
+        if _loader is None:
+            _loader = botocore.loaders.create_loader()
+    session = botocore.session.get_session()
+    session.register_component('data_loader', _loader)
+    return session
+
+
+def _dedupe_search_paths():
+    # boto3.Session appends its resource data path to the loader every time
+    with _loader_lock:
+        paths = []
+        for path in _loader.search_paths:
+            if path not in paths:
+                paths.append(path)
+        _loader.search_paths[:] = paths
+
+
+class ClientPool(object):
+    """
+    Thread-safe cache of boto3 sessions, clients and resources keyed by
+    (aws profile, region, service).
+
+    Creating a boto3 client resolves credentials, loads the service model
+    and opens a new connection pool. Doing that once per key and handing the
+    same client back afterwards lets every call reuse the kept-alive
+    connections. Clients are safe to share between threads, resources are
+    not, so resources are cached per thread.
+
+    Every client draws from the process wide RateLimiters, pass
+    rate_limiters=None to opt out. retry_mode is botocore's retry mode,
+    'adaptive' adds botocore's own client side throttling on top; None
+    leaves it to AWS_RETRY_MODE or the profile's retry_mode.
+    """
+
+    def __init__(self, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+                 rate_limiters=default_rate_limiters, retry_mode=None):
+        self.max_pool_connections = max_pool_connections
+        self.rate_limiters = rate_limiters
+        self.retry_mode = retry_mode
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._clients = {}
+        self._resources = {}
+
+    def config(self):
+        from botocore.config import Config
+
+        kwargs = {}
+        if self.retry_mode:
+            kwargs['retries'] = {'mode': self.retry_mode}
+        return Config(max_pool_connections=self.max_pool_connections,
+                      tcp_keepalive=True, **kwargs)
+
+    def session(self, aws_profile_name=None, region_name=None):
+        """
+        :param aws_profile_name: Profile in ~/.aws/credentials, None for the
+        environment default
+        :param region_name: AWS region, None for the profile default
+        :return: A cached boto3.Session
+        """
+        key = (aws_profile_name, region_name)
+        with self._lock:
+            if key not in self._sessions:
+                import boto3
+
+                session = boto3.Session(botocore_session=botocore_session(),
+                                        profile_name=aws_profile_name,
+                                        region_name=region_name)
+                _dedupe_search_paths()
+                tracer = current_tracer()
+                if tracer is not None:
+                    tracer.instrument_session(session)
+                self._sessions[key] = session
+            return self._sessions[key]
+
+    def client(self, service, aws_profile_name=None, region_name=None):
+        key = (aws_profile_name, region_name, service)
+        with self._lock:
+            if key not in self._clients:
+                session = self.session(aws_profile_name, region_name)
+                client = session.client(service, config=self.config())
+                if self.rate_limiters is not None:
+                    self.rate_limiters.install(client)
+                self._clients[key] = client
+            return self._clients[key]
+
+    def resource(self, service, aws_profile_name=None, region_name=None):
+        key = (threading.current_thread().ident, aws_profile_name,
+               region_name, service)
+        with self._lock:
+            if key not in self._resources:
+                session = self.session(aws_profile_name, region_name)
+                resource = session.resource(service, config=self.config())
+                if self.rate_limiters is not None:
+                    self.rate_limiters.install(resource.meta.client)
+                self._resources[key] = resource
+            return self._resources[key]
+
+    def invalidate(self, aws_profile_name=None, region_name=None,
+                   service=None):
+        """
+        Drop cached entries so they are rebuilt on next use, e.g. after
+        credentials were rotated. Arguments left as None match everything.
+        """
+
+        def matches(profile, region, svc=None):
+            return (aws_profile_name is None or profile == aws_profile_name) \
+                   and (region_name is None or region == region_name) \
+                   and (service is None or svc == service)
+
+        with self._lock:
+            for key in [k for k in self._clients if matches(*k)]:
+                del self._clients[key]
+            for key in [k for k in self._resources if matches(*k[1:])]:
+                del self._resources[key]
+            if service is None:
+                for key in [k for k in self._sessions if matches(*k)]:
+                    del self._sessions[key]
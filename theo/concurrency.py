@@ -0,0 +1,144 @@
+import itertools
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                TimeoutError, wait)
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most size items, lazily
+    >>> list(chunked(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap_unordered(func, iterable, max_workers=DEFAULT_MAX_WORKERS,
+                   max_pending=None):
+    """
+    Apply func to every item of iterable on a bounded thread pool and yield
+    the results as soon as they complete.
+
+    The iterable is consumed lazily with at most max_pending items in
+    flight, so it can be a paginator that is still fetching pages while
+    earlier results are being yielded. An exception raised by func is
+    re-raised in the caller and the remaining work is cancelled.
+    """
+    max_pending = max_pending or max_workers * 2
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for item in iterable:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            else:
+                done = set(f for f in pending if f.done())
+                pending -= done
+            for future in done:
+                yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def fan_out(func, targets, max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+    """
+    Run func(target) for every target concurrently and yield
+    (target, result, error) tuples in completion order. Errors are yielded
+    rather than raised so one failing target does not hide the others.
+
+    A target still running timeout seconds after it started is reported
+    with a TimeoutError and abandoned. A new worker takes the place of the
+    one running it, which exits once the target returns, so abandoned
+    targets never hold up the others. The workers are daemon threads, so
+    an abandoned target does not keep the interpreter from exiting the way
+    a ThreadPoolExecutor worker would. Targets not started yet when the
+    caller stops iterating are never started.
+    """
+    targets = list(targets)
+    todo = queue.Queue()
+    for index in range(len(targets)):
+        todo.put(index)
+    results = queue.Queue()
+    started = {}
+    abandoned = set()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                index = todo.get_nowait()
+            except queue.Empty:
+                return
+            with lock:
+                started[index] = time.time()
+            try:
+                result = (index, func(targets[index]), None)
+            except Exception as e:
+                result = (index, None, e)
+            with lock:
+                del started[index]
+                if index in abandoned:
+                    # Replaced when the target was abandoned
+                    return
+            results.put(result)
+
+    def start_worker():
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+
+    for _ in range(min(max_workers, len(targets))):
+        start_worker()
+
+    finished = set()
+    try:
+        while len(finished) < len(targets):
+            wait_for = None
+            if timeout is not None:
+                with lock:
+                    deadlines = [t + timeout for i, t in started.items()
+                                 if i not in abandoned]
+                wait_for = max(0, min(deadlines) - time.time()) \
+                    if deadlines else timeout
+            try:
+                index, result, error = results.get(timeout=wait_for)
+            except queue.Empty:
+                pass
+            else:
+                finished.add(index)
+                yield targets[index], result, error
+            if timeout is not None:
+                now = time.time()
+                with lock:
+                    expired = [i for i, t in started.items()
+                               if i not in abandoned and now - t >= timeout]
+                    abandoned.update(expired)
+                for index in expired:
+                    if not todo.empty():
+                        start_worker()
+                    finished.add(index)
+                    yield targets[index], None, TimeoutError(
+                        'Timed out after {0}s'.format(timeout))
+    finally:
+        stop.set()
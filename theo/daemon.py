@@ -0,0 +1,282 @@
+"""
+Background process that keeps theo's imports and botocore's parsed service
+models warm, so commands forwarded by theo.client start in milliseconds.
+
+Every command runs in a child forked from the warm daemon, in the caller's
+working directory and environment and on the caller's own stdin, stdout and
+stderr, passed over the socket. Commands therefore behave exactly as they
+would in-process, prompts and colors included, and cannot leak state into
+each other or into the daemon.
+"""
+import array
+import errno
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from .client import code_signature, recv_message, send_message, \
+    socket_path
+
+# Clients created once at start so their service models are parsed and kept
+# in the shared botocore loader
+WARM_SERVICES = ('ecs', 'ecr', 's3', 'cloudformation', 'ssm',
+                 'secretsmanager', 'logs', 'sts')
+DEFAULT_IDLE_TIMEOUT = 3600
+# Largest request accepted, requests carry the caller's whole environment
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+def warm_up():
+    """
+    Import everything a command may need and load the service models
+    """
+    from . import cli, deploy, inventory, output, utils  # noqa: F401
+    from .clients import botocore_session
+
+    import boto3
+    import docker  # noqa: F401
+
+    session = boto3.Session(botocore_session=botocore_session(),
+                            region_name='us-east-1')
+    for service in WARM_SERVICES:
+        session.client(service)
+
+
+def _recv_request(conn, max_fds=3):
+    """
+    Read the request line. The file descriptors arrive with its first
+    bytes, the rest of the line may take any number of reads.
+    :return: (request line, or None when the connection closed or the
+    request is too large, list of received file descriptors)
+    """
+    fds = array.array('i')
+    data, ancdata, _, _ = conn.recvmsg(
+        65536, socket.CMSG_SPACE(max_fds * fds.itemsize))
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[:len(payload) -
+                                  (len(payload) % fds.itemsize)])
+    chunks = [data]
+    size = len(data)
+    while data and b'\n' not in data:
+        if size > MAX_REQUEST_SIZE:
+            return None, list(fds)
+        data = conn.recv(65536)
+        chunks.append(data)
+        size += len(data)
+    line, newline, _ = b''.join(chunks).partition(b'\n')
+    return (line if newline else None), list(fds)
+
+
+def _run_command(request):
+    """
+    Child side of a forked request: become the caller and run the command
+    :return: Exit status
+    """
+    from .cli import theo
+
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    try:
+        theo.main(args=request['argv'], prog_name='theo')
+    except SystemExit as e:
+        code = e.code
+        if code is None:
+            return 0
+        if not isinstance(code, int):
+            sys.stderr.write('{0}\n'.format(code))
+            return 1
+        return code
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class Daemon(object):
+    def __init__(self, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.path = path or socket_path()
+        self.idle_timeout = idle_timeout
+        self.signature = code_signature()
+        self.started = time.time()
+        self.served = 0
+        self.children = set()
+        self.running = False
+        self.server = None
+
+    def bind(self):
+        """
+        :raises RuntimeError: When a daemon already listens on the socket
+        """
+        if is_running(self.path):
+            raise RuntimeError('A theo daemon already listens on {0}'.format(
+                self.path))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            self.server.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.server.listen(64)
+
+    def serve(self):
+        warm_up()
+        self.running = True
+        self.server.settimeout(1.0)
+        last_request = time.time()
+        try:
+            while self.running:
+                self.reap()
+                try:
+                    conn, _ = self.server.accept()
+                except socket.timeout:
+                    if self.idle_timeout and not self.children and \
+                            time.time() - last_request > self.idle_timeout:
+                        break
+                    continue
+                last_request = time.time()
+                try:
+                    self.handle(conn)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    conn.close()
+        finally:
+            self.server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def reap(self):
+        for pid in list(self.children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                done = pid
+            if done:
+                self.children.discard(pid)
+
+    def status(self):
+        return {
+            'pid': os.getpid(),
+            'socket': self.path,
+            'uptime': time.time() - self.started,
+            'served': self.served,
+            'running_commands': len(self.children),
+        }
+
+    def handle(self, conn):
+        conn.settimeout(10)
+        fds = []
+        try:
+            line, fds = _recv_request(conn)
+            try:
+                request = json.loads(line.decode('utf-8'))
+                control = request.get('control')
+            except (AttributeError, ValueError):
+                send_message(conn, {'error': 'malformed request'})
+                return
+            if control == 'status':
+                send_message(conn, self.status())
+            elif control == 'stop':
+                self.running = False
+                send_message(conn, {'stopping': True})
+            elif request.get('signature') != self.signature:
+                # theo was upgraded or edited since the daemon started
+                send_message(conn, {'error': 'stale'})
+                self.running = False
+            elif len(fds) != 3:
+                send_message(conn, {'error': 'stdio not received'})
+            else:
+                self.fork(conn, request, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def fork(self, conn, request, fds):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.served += 1
+            self.children.add(pid)
+            return
+
+        # Child
+        code = 1
+        try:
+            self.server.close()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+            conn.settimeout(None)
+            send_message(conn, {'pid': os.getpid()})
+            code = _run_command(request)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            send_message(conn, {'exit': code})
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code if isinstance(code, int) else 1)
+
+
+def is_running(path=None):
+    return status(path) is not None
+
+
+def status(path=None):
+    """
+    :return: The status dict of the running daemon, None if there is none
+    """
+    return _control('status', path)
+
+
+def stop(path=None):
+    return _control('stop', path) is not None
+
+
+def _control(command, path):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(5)
+    try:
+        conn.connect(path or socket_path())
+        conn.sendall(json.dumps({'control': command}).encode('utf-8') +
+                     b'\n')
+        return recv_message(conn)
+    except (OSError, socket.error, ValueError):
+        return None
+    finally:
+        conn.close()
+
+
+def daemonize(log_path):
+    """
+    Detach from the terminal with the usual double fork
+    :return: False in the original process, True in the daemon
+    """
+    if os.fork():
+        return False
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    log = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+    os.dup2(devnull, 0)
+    os.dup2(log, 1)
+    os.dup2(log, 2)
+    os.close(devnull)
+    os.close(log)
+    return True
@@ -0,0 +1,447 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import botocore.exceptions
+
+from .cache import cache_dir, cache_key, read_json, write_json_atomic
+from .concurrency import DEFAULT_MAX_WORKERS, chunked, fan_out, \
+    imap_unordered
+from .theo import DESCRIBE_SERVICES_BATCH
+from .utils import environment_entries
+
+# Tag carrying the render digest on every task definition theo registers
+RENDER_DIGEST_TAG = 'theo:render-digest'
+
+
+class RolloutError(Exception):
+    pass
+
+
+def _client_error_message(error):
+    """
+    >>> _client_error_message(botocore.exceptions.ClientError(
+    ...     {'Error': {'Code': 'ServiceNotFoundException',
+    ...                'Message': 'Service not found.'}}, 'UpdateService'))
+    'ServiceNotFoundException: Service not found.'
+    """
+    return '{Code}: {Message}'.format(**error.response['Error'])
+
+
+def family_name(file_path):
+    """
+    The default task definition family of a compose file: the name of the
+    directory it lives in
+    >>> family_name('services/web/docker-compose.yml')
+    'web'
+    """
+    return os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+
+
+# depends_on conditions of compose files and their ECS counterparts
+DEPENDS_ON_CONDITIONS = {
+    'service_started': 'START',
+    'service_healthy': 'HEALTHY',
+    'service_completed_successfully': 'SUCCESS',
+}
+MEMORY_UNITS = {'b': 1.0 / 1024 ** 2, 'k': 1.0 / 1024, 'm': 1, 'g': 1024}
+
+_register_shape = None
+
+
+def register_task_definition_shape():
+    """
+    The input shape of ecs.register_task_definition, from the service
+    model in the shared botocore loader
+    """
+    global _register_shape
+    if _register_shape is None:
+        from .clients import botocore_session
+
+        _register_shape = botocore_session().get_service_model(
+            'ecs').operation_model('RegisterTaskDefinition').input_shape
+    return _register_shape
+
+
+def memory_mib(value):
+    """
+    A compose mem_limit in MiB. Numbers without a unit are taken as MiB, as
+    ECS does.
+    >>> memory_mib('512m'), memory_mib('1g'), memory_mib(256)
+    (512, 1024, 256)
+    """
+    if not isinstance(value, str):
+        return value
+    value = value.strip().lower()
+    if value[-1:] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(value)
+
+
+def depends_on(value):
+    """
+    >>> depends_on(['db'])
+    [{'containerName': 'db', 'condition': 'START'}]
+    """
+    if isinstance(value, dict):
+        return [{'containerName': name,
+                 'condition': DEPENDS_ON_CONDITIONS.get(
+                     (options or {}).get('condition'), 'START')}
+                for name, options in sorted(value.items())]
+    return [{'containerName': name, 'condition': 'START'} for name in value]
+
+
+def _conform(value, shape):
+    """
+    Fit a value to a botocore shape: drop unknown and None structure
+    members, and turn numeric strings into integers and scalars into
+    strings where the shape asks for them
+    """
+    if value is None:
+        return None
+    if shape.type_name == 'structure' and isinstance(value, dict):
+        return dict((k, _conform(v, shape.members[k]))
+                    for k, v in value.items()
+                    if k in shape.members and v is not None)
+    if shape.type_name == 'list' and isinstance(value, list):
+        return [_conform(i, shape.member) for i in value]
+    if shape.type_name == 'map' and isinstance(value, dict):
+        return dict((str(k), _conform(v, shape.value))
+                    for k, v in value.items())
+    if shape.type_name == 'integer' and isinstance(value, str) and \
+            value.strip().isdigit():
+        return int(value)
+    if shape.type_name == 'boolean' and isinstance(value, str) and \
+            value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if shape.type_name == 'string' and isinstance(value, bool):
+        return 'true' if value else 'false'
+    if shape.type_name == 'string' and isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def clean_task_definition(task_definition):
+    """
+    Turn a ComposeECS.render dict into valid register_task_definition
+    arguments. Compose keys with an ECS counterpart but no converter are
+    translated (depends_on, environment, mem_limit units), numeric strings
+    such as ports become integers, and compose-only keys without an ECS
+    counterpart (build, restart, ...) and None values are dropped.
+    """
+    task_definition = dict(task_definition)
+    containers = []
+    for container in task_definition.get('containerDefinitions') or []:
+        container = dict(container)
+        if container.get('depends_on'):
+            container.setdefault('dependsOn',
+                                 depends_on(container['depends_on']))
+        if container.get('environment'):
+            container['environment'] = environment_entries(
+                container['environment'])
+        for key in ('memory', 'memoryReservation'):
+            if container.get(key) is not None:
+                container[key] = memory_mib(container[key])
+        containers.append(container)
+    if 'containerDefinitions' in task_definition:
+        task_definition['containerDefinitions'] = containers
+    return _conform(task_definition, register_task_definition_shape())
+
+
+def task_definition_digest(task_definition):
+    """
+    sha256 of the canonical JSON form of a rendered task definition
+    """
+    canonical = json.dumps(clean_task_definition(task_definition),
+                           sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class DeployIndex(object):
+    """
+    Local record of the render digest and task definition ARN last
+    registered for each family, one JSON file per (aws profile, region)
+    under ~/.cache/theo/deploy.
+    """
+
+    def __init__(self, aws_profile_name, region_name, path=None):
+        self.file_path = os.path.join(
+            path or cache_dir('deploy'),
+            cache_key(aws_profile_name, region_name) + '.json')
+        self._lock = threading.Lock()
+        self._entries = read_json(self.file_path) or {}
+
+    def get(self, family):
+        with self._lock:
+            return self._entries.get(family)
+
+    def set(self, family, digest, task_definition_arn):
+        with self._lock:
+            self._entries[family] = {
+                'digest': digest,
+                'taskDefinitionArn': task_definition_arn,
+            }
+            write_json_atomic(self.file_path, self._entries)
+
+
+class TaskDefinitionDeployer(object):
+    """
+    Registers rendered task definitions only when they changed and points
+    the matching ECS services at the new revisions.
+
+    A family is unchanged when its render digest matches the
+    RENDER_DIGEST_TAG of the latest active revision. With verify=False a
+    matching local DeployIndex entry is trusted and no API call is made.
+    """
+
+    def __init__(self, theo_ins, index=None, max_workers=DEFAULT_MAX_WORKERS):
+        self.theo_ins = theo_ins
+        self.ecs = theo_ins.client('ecs')
+        self.index = index or DeployIndex(theo_ins.aws_target()[0],
+                                          self.ecs.meta.region_name)
+        self.max_workers = max_workers
+
+    def latest_revision(self, family):
+        """
+        :return: (task definition ARN, render digest) of the latest active
+        revision, (None, None) when the family has none
+        """
+        try:
+            response = self.ecs.describe_task_definition(
+                taskDefinition=family, include=['TAGS'])
+        except self.ecs.exceptions.ClientException:
+            return None, None
+        tags = dict((i['key'], i['value']) for i in response.get('tags', []))
+        return (response['taskDefinition']['taskDefinitionArn'],
+                tags.get(RENDER_DIGEST_TAG))
+
+    def plan(self, task_definitions, verify=True):
+        """
+        :param task_definitions: List of ComposeECS.render() dicts
+        :return: List of {'family', 'digest', 'changed', 'taskDefinitionArn'}
+        dicts in input order
+        """
+        def check(index):
+            task_definition = task_definitions[index]
+            family = task_definition['family']
+            digest = task_definition_digest(task_definition)
+            entry = self.index.get(family)
+            if not verify and entry and entry['digest'] == digest:
+                return family, digest, False, entry['taskDefinitionArn']
+            arn, remote_digest = self.latest_revision(family)
+            if remote_digest == digest:
+                self.index.set(family, digest, arn)
+                return family, digest, False, arn
+            return family, digest, True, None
+
+        plan = [None] * len(task_definitions)
+        for index, result, error in fan_out(
+                check, range(len(task_definitions)), self.max_workers):
+            if error is not None:
+                raise error
+            family, digest, changed, arn = result
+            plan[index] = {
+                'family': family,
+                'digest': digest,
+                'changed': changed,
+                'taskDefinitionArn': arn,
+            }
+        return plan
+
+    def register(self, task_definition, digest):
+        """
+        :return: The new task definition ARN
+        """
+        response = self.ecs.register_task_definition(
+            tags=[{'key': RENDER_DIGEST_TAG, 'value': digest}],
+            **clean_task_definition(task_definition))
+        arn = response['taskDefinition']['taskDefinitionArn']
+        self.index.set(task_definition['family'], digest, arn)
+        return arn
+
+    def update_service(self, cluster, service, task_definition_arn):
+        """
+        :raises RolloutError: When ECS refuses the update, e.g. for a
+        missing or inactive service
+        """
+        try:
+            return self.ecs.update_service(
+                cluster=cluster, service=service,
+                taskDefinition=task_definition_arn)['service']
+        except botocore.exceptions.ClientError as e:
+            raise RolloutError('{0}: {1}'.format(service,
+                                                 _client_error_message(e)))
+
+    def register_changed(self, task_definitions, services=None,
+                         verify=True):
+        """
+        Register the changed task definitions without touching services
+        :param services: Dict of family to a list of ECS service names,
+        a family maps to the service of the same name by default
+        :return: The plan, with 'services' listing the services to update
+        """
+        services = services or {}
+        plan = self.plan(task_definitions, verify)
+        for task_definition, entry in zip(task_definitions, plan):
+            entry['services'] = []
+            if not entry['changed']:
+                continue
+            entry['taskDefinitionArn'] = self.register(task_definition,
+                                                       entry['digest'])
+            entry['services'] = services.get(entry['family'],
+                                             [entry['family']])
+        return plan
+
+    def deploy(self, task_definitions, cluster, services=None, verify=True):
+        """
+        Register the changed task definitions and update their services
+        without waiting for them, see DeployEngine for that
+        :return: The plan of register_changed
+        :raises RolloutError: See update_service
+        """
+        plan = self.register_changed(task_definitions, services, verify)
+        for entry in plan:
+            for service in entry['services']:
+                self.update_service(cluster, service,
+                                    entry['taskDefinitionArn'])
+        return plan
+
+
+def service_state(service, task_definition_arn):
+    """
+    Where a service rollout to task_definition_arn stands
+    :param service: A dict from ecs.describe_services
+    :return: ('stable' | 'failed' | 'in_progress', message)
+    """
+    if service.get('status') != 'ACTIVE':
+        return 'failed', 'service is {0}'.format(service.get('status'))
+    deployments = service.get('deployments', [])
+    primary = [i for i in deployments if i['status'] == 'PRIMARY']
+    if not primary:
+        return 'in_progress', 'no primary deployment yet'
+    primary = primary[0]
+    if primary['taskDefinition'] != task_definition_arn:
+        # The circuit breaker rolled back, or someone else deployed
+        return 'failed', 'primary deployment runs {0}'.format(
+            primary['taskDefinition'].split('/')[-1])
+    if primary.get('rolloutState') == 'FAILED':
+        return 'failed', primary.get('rolloutStateReason', 'rollout failed')
+    message = '{0}/{1} running, {2} pending'.format(
+        primary.get('runningCount', 0), primary.get('desiredCount', 0),
+        primary.get('pendingCount', 0))
+    if primary.get('failedTasks'):
+        message += ', {0} failed'.format(primary['failedTasks'])
+    if len(deployments) == 1 and \
+            primary.get('runningCount') == primary.get('desiredCount') and \
+            primary.get('rolloutState', 'COMPLETED') == 'COMPLETED':
+        return 'stable', message
+    return 'in_progress', message
+
+
+class DeployEngine(object):
+    """
+    Rolls task definitions out to many ECS services at once.
+
+    At most max_concurrency services are rolling at the same time, and a
+    service only starts once every service it depends on is stable. All
+    rolling services are tracked together with describe_services batches
+    of DESCRIBE_SERVICES_BATCH, polled every min_interval seconds while
+    anything moves and backing off towards max_interval while nothing
+    does. The first failed or rolled back service aborts the deploy.
+    """
+
+    def __init__(self, theo_ins, cluster, max_concurrency=5,
+                 min_interval=2.0, max_interval=30.0, timeout=1800,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        self.ecs = theo_ins.client('ecs')
+        self.cluster = cluster
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.max_workers = max_workers
+
+    def describe_services(self, services):
+        def describe(batch):
+            return self.ecs.describe_services(cluster=self.cluster,
+                                              services=batch)['services']
+
+        result = {}
+        for batch in imap_unordered(
+                describe, chunked(services, DESCRIBE_SERVICES_BATCH),
+                self.max_workers):
+            for service in batch:
+                result[service['serviceName']] = service
+        return result
+
+    def run(self, updates, dependencies=None):
+        """
+        :param updates: Dict of ECS service name to task definition ARN
+        :param dependencies: Dict of service name to the services that must
+        be stable before it is updated; services outside updates are ignored
+        :return: Generator of {'service', 'state', 'message'} progress
+        events, state is one of updating, in_progress, stable or failed
+        :raises RolloutError: On the first failed service, after its event,
+        including a service ECS refuses to update, or when the timeout
+        expires
+        """
+        dependencies = dependencies or {}
+        waiting = list(updates)
+        rolling = {}
+        done = set()
+        last_message = {}
+        interval = self.min_interval
+        deadline = time.time() + self.timeout
+
+        while waiting or rolling:
+            for service in list(waiting):
+                if len(rolling) >= self.max_concurrency:
+                    break
+                if any(i in updates and i not in done
+                       for i in dependencies.get(service, [])):
+                    continue
+                try:
+                    self.ecs.update_service(cluster=self.cluster,
+                                            service=service,
+                                            taskDefinition=updates[service])
+                except botocore.exceptions.ClientError as e:
+                    message = _client_error_message(e)
+                    yield {'service': service, 'state': 'failed',
+                           'message': message}
+                    raise RolloutError('{0}: {1}'.format(service, message))
+                waiting.remove(service)
+                rolling[service] = updates[service]
+                yield {'service': service, 'state': 'updating',
+                       'message': updates[service].split('/')[-1]}
+            if not rolling:
+                raise RolloutError(
+                    'Unresolvable dependencies between {0}'.format(
+                        ', '.join(waiting)))
+            if time.time() > deadline:
+                raise RolloutError('Timed out waiting for {0}'.format(
+                    ', '.join(rolling)))
+
+            time.sleep(interval)
+            moved = False
+            described = self.describe_services(list(rolling))
+            for service, arn in list(rolling.items()):
+                if service not in described:
+                    state, message = 'failed', 'service not found'
+                else:
+                    state, message = service_state(described[service], arn)
+                if message == last_message.get(service) and \
+                        state == 'in_progress':
+                    continue
+                moved = True
+                last_message[service] = message
+                yield {'service': service, 'state': state,
+                       'message': message}
+                if state == 'failed':
+                    raise RolloutError('{0}: {1}'.format(service, message))
+                if state == 'stable':
+                    del rolling[service]
+                    done.add(service)
+            interval = self.min_interval if moved else \
+                min(interval * 1.5, self.max_interval)
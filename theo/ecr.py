@@ -0,0 +1,91 @@
+import base64
+import calendar
+import os
+import threading
+import time
+
+from .cache import cache_dir, cache_key, read_json, write_json_atomic
+
+# ECR tokens last 12 hours, stop handing them out this many seconds early
+SAFETY_MARGIN = 15 * 60
+
+
+def decode_authorization(auth_data):
+    """
+    Turn one ecr.get_authorization_token authorizationData entry into the
+    dict that TokenCache stores
+    """
+    token = base64.b64decode(auth_data['authorizationToken']).decode('utf-8')
+    # The token is "AWS:<password>", strip the user name prefix
+    _, _, password = token.partition(':')
+    expires_at = auth_data['expiresAt']
+    if not isinstance(expires_at, (int, float)):
+        expires_at = calendar.timegm(expires_at.utctimetuple())
+    return {
+        'password': password,
+        'endpoint': auth_data['proxyEndpoint'].replace('https://', ''),
+        'expires_at': expires_at,
+    }
+
+
+def endpoint_registry_id(endpoint):
+    """
+    >>> endpoint_registry_id('123456789012.dkr.ecr.us-east-1.amazonaws.com')
+    '123456789012'
+    """
+    return endpoint.split('.', 1)[0]
+
+
+class TokenCache(object):
+    """
+    ECR authorization tokens cached in memory and on disk, keyed by
+    registry ID, AWS profile and region. The files are written with 0600
+    permissions in a 0700 directory.
+    """
+
+    def __init__(self, path=None, safety_margin=SAFETY_MARGIN):
+        self._path = path
+        self.safety_margin = safety_margin
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = cache_dir('ecr')
+        return self._path
+
+    def _file(self, key):
+        return os.path.join(self.path, cache_key(*key) + '.json')
+
+    def _valid(self, token):
+        return token is not None and \
+               token['expires_at'] - self.safety_margin > time.time()
+
+    def get(self, registry_id, aws_profile_name, region_name):
+        key = (registry_id, aws_profile_name, region_name)
+        with self._lock:
+            token = self._memory.get(key)
+            if self._valid(token):
+                return token
+            token = read_json(self._file(key))
+            if self._valid(token):
+                self._memory[key] = token
+                return token
+            return None
+
+    def put(self, registry_id, aws_profile_name, region_name, token):
+        key = (registry_id, aws_profile_name, region_name)
+        with self._lock:
+            self._memory[key] = token
+            write_json_atomic(self._file(key), token)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for name in os.listdir(self.path):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.path, name))
+
+
+default_token_cache = TokenCache()
@@ -0,0 +1,188 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import time
+
+
+class DockerStreamError(Exception):
+    pass
+
+
+def iter_json_stream(chunks):
+    """
+    Decode the JSON progress stream of docker build/push/pull as it
+    arrives. A chunk may hold several newline separated objects or only
+    part of one.
+    :param chunks: Iterable of bytes or str as returned with stream=True
+    :return: Generator of event dicts
+    :raises DockerStreamError: When the daemon reports an error
+    """
+    buf = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = chunk.decode('utf-8')
+        buf += chunk
+        while '\n' in buf:
+            line, buf = buf.split('\n', 1)
+            if line.strip():
+                yield _decode_event(line)
+    if buf.strip():
+        yield _decode_event(buf)
+
+
+def _decode_event(line):
+    event = json.loads(line)
+    if 'error' in event:
+        raise DockerStreamError(event['error'])
+    return event
+
+
+class LayerProgress(object):
+    """
+    Per-layer byte counts and throughput for a docker push, fed one
+    progress event at a time.
+    """
+
+    def __init__(self):
+        self.layers = {}
+
+    def update(self, event):
+        """
+        :return: The layer dict when the event finished a layer, else None
+        """
+        layer_id = event.get('id')
+        status = event.get('status', '')
+        if not layer_id or status in ('Preparing', 'Waiting'):
+            return None
+        layer = self.layers.setdefault(layer_id, {
+            'id': layer_id, 'bytes': 0, 'started': time.time(),
+            'seconds': 0.0, 'status': 'pushing'})
+        if layer['status'] != 'pushing':
+            # Pushing further tags reports the layer again as existing
+            return None
+        if status == 'Pushing':
+            layer['bytes'] = event.get('progressDetail', {}).get(
+                'current', layer['bytes'])
+            return None
+        if status == 'Pushed':
+            layer['status'] = 'pushed'
+        elif status == 'Layer already exists':
+            layer['status'] = 'exists'
+        else:
+            return None
+        layer['seconds'] = time.time() - layer['started']
+        return layer
+
+    def summary(self):
+        """
+        :return: List of {'id', 'status', 'bytes', 'seconds', 'rate'} dicts
+        where rate is in bytes per second
+        """
+        result = []
+        for layer in self.layers.values():
+            rate = layer['bytes'] / layer['seconds'] if layer['seconds'] \
+                else 0.0
+            result.append({
+                'id': layer['id'],
+                'status': layer['status'],
+                'bytes': layer['bytes'],
+                'seconds': layer['seconds'],
+                'rate': rate,
+            })
+        return result
+
+
+def format_bytes(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024.0:
+            return '{0:.1f}{1}'.format(num, unit)
+        num /= 1024.0
+    return '{0:.1f}TB'.format(num)
+
+
+CONTEXT_DIGEST_LABEL = 'theo.context-digest'
+# Images pushed from a build context are also tagged with this prefix plus
+# the context digest, so a later build of the same context can be found in
+# ECR without pulling anything
+CONTEXT_TAG_PREFIX = 'ctx-'
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def read_dockerignore(path):
+    try:
+        with open(os.path.join(path, '.dockerignore'), 'r') as f:
+            lines = f.read().splitlines()
+    except IOError:
+        return []
+    return [i.strip() for i in lines if i.strip() and
+            not i.strip().startswith('#')]
+
+
+class BuildContext(object):
+    """
+    A docker build context on disk: the directory of a Dockerfile minus
+    whatever its .dockerignore excludes.
+
+    digest is a sha256 over the path, mode and content of every file in the
+    context plus the build args, so it only changes when the build input
+    does. write() streams the context as a tarball straight from disk into
+    a file object, with a LABEL carrying the digest appended to the
+    Dockerfile.
+    """
+
+    def __init__(self, file_path, buildargs=None):
+        self.path, self.dockerfile = os.path.split(os.path.abspath(file_path))
+        self.buildargs = buildargs or {}
+        self._paths = None
+        self._digest = None
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            from docker.utils import exclude_paths
+
+            self._paths = sorted(exclude_paths(
+                self.path, read_dockerignore(self.path),
+                dockerfile=self.dockerfile))
+        return self._paths
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            h = hashlib.sha256()
+            for rel_path in self.paths:
+                full_path = os.path.join(self.path, rel_path)
+                st = os.lstat(full_path)
+                h.update(u'{0}\0{1:o}\0'.format(rel_path,
+                                                st.st_mode).encode('utf-8'))
+                if stat.S_ISLNK(st.st_mode):
+                    h.update(os.readlink(full_path).encode('utf-8'))
+                elif stat.S_ISREG(st.st_mode):
+                    with open(full_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+                            h.update(chunk)
+            for k in sorted(self.buildargs):
+                h.update(u'\0{0}={1}'.format(
+                    k, self.buildargs[k]).encode('utf-8'))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def write(self, fileobj):
+        tar = tarfile.open(mode='w', fileobj=fileobj)
+        for rel_path in self.paths:
+            full_path = os.path.join(self.path, rel_path)
+            if rel_path == self.dockerfile:
+                with open(full_path, 'rb') as f:
+                    data = f.read()
+                data += u'\nLABEL {0}={1}\n'.format(
+                    CONTEXT_DIGEST_LABEL, self.digest).encode('utf-8')
+                info = tar.gettarinfo(full_path, arcname=rel_path)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            else:
+                tar.add(full_path, arcname=rel_path, recursive=False)
+        tar.close()
@@ -0,0 +1,417 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import cache_dir
+from .concurrency import DEFAULT_MAX_WORKERS, chunked, fan_out, \
+    imap_unordered
+from .output import dumps
+from .theo import DESCRIBE_TASKS_BATCH
+
+# Bump when the schema changes, older inventories are dropped and rebuilt
+SCHEMA_VERSION = 1
+
+# Seconds a listing is served from the inventory before it is refreshed
+DEFAULT_TTLS = {
+    'clusters': 60,
+    'tasks': 15,
+    'repos': 300,
+}
+
+# Clusters or repositories written per transaction while a refresh streams
+WRITE_BATCH = 100
+
+# How a listing is answered
+AUTO = 'auto'        # From the inventory while within its TTL
+CACHED = 'cached'    # From the inventory however old, AWS only when empty
+REFRESH = 'refresh'  # From AWS, updating the inventory
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refreshes (
+    kind TEXT NOT NULL,
+    aws_profile TEXT NOT NULL,
+    region TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (kind, aws_profile, region, scope)
+);
+CREATE TABLE IF NOT EXISTS clusters (
+    aws_profile TEXT NOT NULL,
+    region TEXT NOT NULL,
+    arn TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (aws_profile, region, arn)
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    aws_profile TEXT NOT NULL,
+    region TEXT NOT NULL,
+    cluster TEXT NOT NULL,
+    arn TEXT NOT NULL,
+    last_status TEXT,
+    service TEXT,
+    family TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (aws_profile, region, cluster, arn)
+);
+CREATE INDEX IF NOT EXISTS tasks_service
+    ON tasks (aws_profile, region, cluster, service);
+CREATE INDEX IF NOT EXISTS tasks_status
+    ON tasks (aws_profile, region, cluster, last_status);
+CREATE INDEX IF NOT EXISTS tasks_family
+    ON tasks (aws_profile, region, cluster, family);
+CREATE TABLE IF NOT EXISTS repos (
+    aws_profile TEXT NOT NULL,
+    region TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (aws_profile, region, name)
+);
+"""
+
+
+def task_service(task):
+    """
+    The ECS service that started a task, None for standalone tasks
+    """
+    group = task.get('group') or ''
+    return group[len('service:'):] if group.startswith('service:') else None
+
+
+def task_family(task):
+    """
+    >>> task_family({'taskDefinitionArn': 'arn:...:task-definition/web:12'})
+    'web'
+    """
+    arn = task.get('taskDefinitionArn') or ''
+    return arn.split('/')[-1].rsplit(':', 1)[0] or None
+
+
+class InventoryStore(object):
+    """
+    SQLite inventory of clusters, tasks and repositories under
+    ~/.cache/theo, keyed by (aws profile, region). None for either is
+    stored as '' and means whatever default theo resolved it to.
+
+    Tasks are indexed by service, last status and task definition family.
+    The refreshes table records when each listing was last fetched from
+    AWS, which is what the TTLs are checked against. Refreshes are written
+    a batch per transaction as they stream in, and only recorded in that
+    table once the listing is complete and what vanished from it is
+    deleted.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), 'inventory.sqlite')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30,
+                                   check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        with self._lock, self._db:
+            if version != SCHEMA_VERSION:
+                for table in ('refreshes', 'clusters', 'tasks', 'repos'):
+                    self._db.execute('DROP TABLE IF EXISTS ' + table)
+                self._db.execute('PRAGMA user_version = {0:d}'.format(
+                    SCHEMA_VERSION))
+            self._db.executescript(SCHEMA)
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _iter_query(self, sql, args=(), size=500):
+        """
+        Generator of the rows of a query, fetched size rows at a time so
+        large listings are never held in memory at once
+        """
+        with self._lock:
+            cursor = self._db.execute(sql, args)
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+    def refreshed_at(self, kind, aws_profile_name, region_name, scope=''):
+        """
+        :return: When the listing was last refreshed, None if never
+        """
+        rows = self._query(
+            'SELECT refreshed_at FROM refreshes WHERE kind = ? AND '
+            'aws_profile = ? AND region = ? AND scope = ?',
+            (kind, aws_profile_name or '', region_name or '', scope))
+        return rows[0][0] if rows else None
+
+    def _mark_refreshed(self, kind, aws_profile_name, region_name, scope=''):
+        self._db.execute(
+            'INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?, ?)',
+            (kind, aws_profile_name or '', region_name or '', scope,
+             time.time()))
+
+    def _prune(self, kind, column, key, kept, scope=''):
+        """
+        Delete the rows of a listing whose column is not in kept and record
+        the listing as refreshed, as one transaction
+        :param key: Values of the leading columns of the table
+        """
+        where = ' AND '.join(
+            '{0} = ?'.format(i) for i in
+            ('aws_profile', 'region', 'cluster')[:len(key)])
+        with self._lock, self._db:
+            stored = [i[0] for i in self._db.execute(
+                'SELECT {0} FROM {1} WHERE {2}'.format(column, kind, where),
+                key).fetchall()]
+            self._db.executemany(
+                'DELETE FROM {0} WHERE {1} AND {2} = ?'.format(kind, where,
+                                                               column),
+                [key + (i,) for i in stored if i not in kept])
+            self._mark_refreshed(kind, key[0], key[1], scope)
+
+    def clusters(self, aws_profile_name, region_name):
+        rows = self._query(
+            'SELECT data FROM clusters WHERE aws_profile = ? AND region = ? '
+            'ORDER BY name', (aws_profile_name or '', region_name or ''))
+        return [json.loads(i[0]) for i in rows]
+
+    def put_clusters(self, aws_profile_name, region_name, clusters):
+        key = (aws_profile_name or '', region_name or '')
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?, ?)',
+                [key + (i['clusterArn'], i['clusterName'], i.get('status'),
+                        dumps(i)) for i in clusters])
+
+    def prune_clusters(self, aws_profile_name, region_name, arns):
+        """
+        Forget the clusters whose ARN is not in arns
+        """
+        self._prune('clusters', 'arn',
+                    (aws_profile_name or '', region_name or ''), arns)
+
+    def tasks(self, aws_profile_name, region_name, cluster, service=None,
+              last_status=None, family=None):
+        sql = 'SELECT data FROM tasks WHERE aws_profile = ? AND region = ? ' \
+              'AND cluster = ?'
+        args = [aws_profile_name or '', region_name or '', cluster]
+        for column, value in (('service', service),
+                              ('last_status', last_status),
+                              ('family', family)):
+            if value is not None:
+                sql += ' AND {0} = ?'.format(column)
+                args.append(value)
+        return (json.loads(i[0]) for i in self._iter_query(sql, args))
+
+    def task_statuses(self, aws_profile_name, region_name, cluster):
+        """
+        :return: Dict of stored task ARN to its last status
+        """
+        return dict(self._query(
+            'SELECT arn, last_status FROM tasks WHERE aws_profile = ? AND '
+            'region = ? AND cluster = ?',
+            (aws_profile_name or '', region_name or '', cluster)))
+
+    def tasks_by_arn(self, aws_profile_name, region_name, cluster, arns):
+        """
+        The stored tasks of up to DESCRIBE_TASKS_BATCH ARNs
+        """
+        rows = self._query(
+            'SELECT data FROM tasks WHERE aws_profile = ? AND region = ? AND '
+            'cluster = ? AND arn IN ({0})'.format(', '.join('?' * len(arns))),
+            [aws_profile_name or '', region_name or '', cluster] + list(arns))
+        return [json.loads(i[0]) for i in rows]
+
+    def put_tasks(self, aws_profile_name, region_name, cluster, tasks):
+        """
+        Insert or replace a batch of described tasks, as one transaction
+        """
+        key = (aws_profile_name or '', region_name or '', cluster)
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [key + (i['taskArn'], i.get('lastStatus'), task_service(i),
+                        task_family(i), dumps(i)) for i in tasks])
+
+    def prune_tasks(self, aws_profile_name, region_name, cluster, arns):
+        """
+        Forget the tasks of a cluster whose ARN is not in arns
+        """
+        self._prune('tasks', 'arn',
+                    (aws_profile_name or '', region_name or '', cluster),
+                    arns, cluster)
+
+    def repos(self, aws_profile_name, region_name):
+        rows = self._query(
+            'SELECT data FROM repos WHERE aws_profile = ? AND region = ? '
+            'ORDER BY name', (aws_profile_name or '', region_name or ''))
+        return [json.loads(i[0]) for i in rows]
+
+    def put_repos(self, aws_profile_name, region_name, repos):
+        key = (aws_profile_name or '', region_name or '')
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?)',
+                [key + (i['repositoryName'], dumps(i)) for i in repos])
+
+    def prune_repos(self, aws_profile_name, region_name, names):
+        """
+        Forget the repositories whose name is not in names
+        """
+        self._prune('repos', 'name',
+                    (aws_profile_name or '', region_name or ''), names)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Inventory(object):
+    """
+    Theo's cluster, task and repository listings answered from an
+    InventoryStore, see AUTO, CACHED and REFRESH for when AWS is asked.
+
+    A refresh streams: each batch is yielded as soon as AWS returns it,
+    while it is written to the store, so the first records print while
+    the listing is still paging and memory stays at a batch.
+
+    Task refreshes are incremental: the task ARNs are listed, tasks that
+    disappeared are dropped, and only new ARNs plus known tasks that were
+    not RUNNING yet are described again. REFRESH describes every listed
+    task, so health and container state are current. Clusters are
+    re-described in full since their counters change without their ARNs
+    changing, which costs one call per DESCRIBE_CLUSTERS_BATCH clusters.
+    """
+
+    def __init__(self, theo_ins, store=None, ttls=None,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        self.theo_ins = theo_ins
+        self.store = store or InventoryStore()
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_workers = max_workers
+
+    def _needs_refresh(self, kind, aws_profile_name, region_name, mode,
+                       scope=''):
+        if mode == REFRESH:
+            return True
+        refreshed_at = self.store.refreshed_at(kind, aws_profile_name,
+                                               region_name, scope)
+        if refreshed_at is None:
+            return True
+        return mode == AUTO and time.time() - refreshed_at > self.ttls[kind]
+
+    def refresh_clusters(self, aws_profile_name=None, region_name=None):
+        """
+        :return: Generator of the described clusters, stored as they come
+        """
+        arns = set()
+        for clusters in chunked(self.theo_ins.iter_clusters(aws_profile_name,
+                                                            region_name),
+                                WRITE_BATCH):
+            self.store.put_clusters(aws_profile_name, region_name, clusters)
+            for cluster in clusters:
+                arns.add(cluster['clusterArn'])
+                yield cluster
+        self.store.prune_clusters(aws_profile_name, region_name, arns)
+
+    def clusters(self, aws_profile_name=None, region_name=None, mode=AUTO):
+        """
+        :return: Iterable of ecs.describe_clusters cluster dicts
+        """
+        if self._needs_refresh('clusters', aws_profile_name, region_name,
+                               mode):
+            return self.refresh_clusters(aws_profile_name, region_name)
+        return self.store.clusters(aws_profile_name, region_name)
+
+    def fan_out_clusters(self, targets, mode=AUTO,
+                         max_workers=DEFAULT_MAX_WORKERS, timeout=None):
+        """
+        Theo.fan_out_clusters through the inventory
+        """
+        return fan_out(lambda target: list(self.clusters(target[0], target[1],
+                                                         mode)),
+                       targets, max_workers, timeout)
+
+    def refresh_tasks(self, cluster, aws_profile_name=None, full=False):
+        """
+        :param full: Describe every listed task again, not only the new
+        ones and those that were not RUNNING yet
+        :return: Generator of every listed task, a batch at a time as ECS
+        pages the ARNs, the described ones stored as they come
+        """
+        statuses = self.store.task_statuses(aws_profile_name, None, cluster)
+        listed = set()
+
+        def arns():
+            for arn in self.theo_ins.iter_task_arns(cluster,
+                                                    aws_profile_name):
+                listed.add(arn)
+                yield arn
+
+        def describe(task_arns):
+            stale = [arn for arn in task_arns
+                     if full or statuses.get(arn) != 'RUNNING']
+            tasks = self.theo_ins.describe_tasks(
+                cluster, stale, aws_profile_name) if stale else []
+            return tasks, set(task_arns) - set(stale)
+
+        for tasks, kept in imap_unordered(
+                describe, chunked(arns(), DESCRIBE_TASKS_BATCH),
+                self.max_workers):
+            if tasks:
+                self.store.put_tasks(aws_profile_name, None, cluster, tasks)
+            if kept:
+                tasks = tasks + self.store.tasks_by_arn(
+                    aws_profile_name, None, cluster, kept)
+            for task in tasks:
+                yield task
+        self.store.prune_tasks(aws_profile_name, None, cluster, listed)
+
+    def tasks(self, cluster, aws_profile_name=None, service=None,
+              last_status=None, family=None, mode=AUTO):
+        """
+        The tasks ecs.list_tasks returns by default, i.e. desired status
+        RUNNING, filtered through the inventory indexes
+        :return: Generator of ecs.describe_tasks task dicts
+        """
+        if not self._needs_refresh('tasks', aws_profile_name, None, mode,
+                                   cluster):
+            return self.store.tasks(aws_profile_name, None, cluster, service,
+                                    last_status, family)
+        return (i for i in self.refresh_tasks(cluster, aws_profile_name,
+                                              full=mode == REFRESH)
+                if (service is None or task_service(i) == service) and
+                (last_status is None or i.get('lastStatus') == last_status) and
+                (family is None or task_family(i) == family))
+
+    def refresh_repos(self):
+        """
+        :return: Generator of the repositories of the loaded settings'
+        profile and region, stored as they come
+        """
+        aws_profile_name, region_name = self.theo_ins.aws_target()
+        names = set()
+        for repos in chunked(self.theo_ins.iter_repos(), WRITE_BATCH):
+            self.store.put_repos(aws_profile_name, region_name, repos)
+            for repo in repos:
+                names.add(repo['repositoryName'])
+                yield repo
+        self.store.prune_repos(aws_profile_name, region_name, names)
+
+    def repos(self, mode=AUTO):
+        """
+        The repositories of the loaded settings' profile and region
+        :return: Iterable of ecr.describe_repositories repository dicts
+        """
+        aws_profile_name, region_name = self.theo_ins.aws_target()
+        if self._needs_refresh('repos', aws_profile_name, region_name, mode):
+            return self.refresh_repos()
+        return self.store.repos(aws_profile_name, region_name)
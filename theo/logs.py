@@ -0,0 +1,299 @@
+import heapq
+import time
+from collections import deque
+
+from .concurrency import DEFAULT_MAX_WORKERS, imap_unordered
+
+# Events a single filter_log_events call returns at most, which bounds what
+# each source holds in memory at once
+PAGE_SIZE = 1000
+# Seconds of history printed before following
+DEFAULT_SINCE = 600
+# Seconds between two looks for new deployments of the service while
+# following, they may log to other groups or containers
+DISCOVER_INTERVAL = 60.0
+# Maximum number of stream names a single filter_log_events call accepts
+MAX_STREAM_NAMES = 100
+
+SINCE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class LogsError(Exception):
+    pass
+
+
+def parse_since(value):
+    """
+    >>> parse_since('10m')
+    600
+    >>> parse_since('90')
+    90
+    """
+    value = value.strip().lower()
+    if value[-1:] in SINCE_UNITS:
+        return int(value[:-1]) * SINCE_UNITS[value[-1]]
+    return int(value)
+
+
+def stream_label(stream_name):
+    """
+    A short name for an awslogs stream, prefix/container/task-id
+    >>> stream_label('web/nginx/0123456789abcdef0123456789abcdef')
+    'nginx/01234567'
+    """
+    parts = stream_name.split('/')
+    if len(parts) == 3:
+        return '{0}/{1}'.format(parts[1], parts[2][:8])
+    return stream_name
+
+
+def log_sources(theo_ins, cluster, service, containers=None):
+    """
+    Where the tasks of a service log to, read from the awslogs options of
+    the task definitions of its deployments
+    :param containers: Only these container names, all when empty
+    :return: Dict of (region, log group, stream name prefix) to a set of
+    stream names or None. awslogs names streams prefix/container/task-id,
+    which the prefix selects. Containers without an awslogs-stream-prefix
+    have their streams named after their docker container ID instead, so
+    their key has a None prefix and the stream names of the service's
+    running tasks, which keeps out other services logging to the group.
+    :raises LogsError: When the service does not exist, or runs more than
+    MAX_STREAM_NAMES containers without a stream prefix in a group
+    """
+    ecs = theo_ins.client('ecs')
+    services = ecs.describe_services(cluster=cluster,
+                                     services=[service])['services']
+    if not services:
+        raise LogsError('Service {0} not found in {1}'.format(service,
+                                                              cluster))
+    arns = set(i['taskDefinition'] for i in services[0].get('deployments', []))
+
+    def describe(arn):
+        return ecs.describe_task_definition(
+            taskDefinition=arn)['taskDefinition']
+
+    sources = {}
+    # (task definition ARN, container name) to the key of its group
+    unprefixed = {}
+    for task_definition in imap_unordered(describe, arns):
+        for container in task_definition['containerDefinitions']:
+            if containers and container['name'] not in containers:
+                continue
+            log_configuration = container.get('logConfiguration') or {}
+            if log_configuration.get('logDriver') != 'awslogs':
+                continue
+            options = log_configuration.get('options', {})
+            prefix = options.get('awslogs-stream-prefix')
+            if prefix:
+                stream_prefix = '{0}/{1}/'.format(prefix, container['name'])
+                sources[(options.get('awslogs-region'),
+                         options['awslogs-group'], stream_prefix)] = None
+                continue
+            key = (options.get('awslogs-region'), options['awslogs-group'],
+                   None)
+            sources.setdefault(key, set())
+            unprefixed[(task_definition['taskDefinitionArn'],
+                        container['name'])] = key
+
+    if unprefixed:
+        for task in theo_ins.iter_tasks(cluster, service_name=service):
+            for container in task.get('containers', []):
+                key = unprefixed.get((task['taskDefinitionArn'],
+                                      container['name']))
+                if key is not None and container.get('runtimeId'):
+                    sources[key].add(container['runtimeId'])
+        for key, names in sources.items():
+            if names is not None and len(names) > MAX_STREAM_NAMES:
+                raise LogsError(
+                    'More than {0} containers log to {1} without an '
+                    'awslogs-stream-prefix, set one to read their '
+                    'logs'.format(MAX_STREAM_NAMES, key[1]))
+    return sources
+
+
+class LogSource(object):
+    """
+    The events of a log group, of its streams starting with a prefix or of
+    a set of named streams, read forward one filter_log_events page at a
+    time. Only the current page is held. Once the last page is read the
+    source is caught up, and the next fetch queries again from the
+    timestamp of the last event seen, skipping the events already returned
+    at that millisecond.
+    """
+
+    def __init__(self, client, group, stream_prefix=None, start_time=None,
+                 filter_pattern=None, page_size=PAGE_SIZE,
+                 stream_names=None):
+        self.client = client
+        self.group = group
+        self.stream_prefix = stream_prefix
+        self.stream_names = None if stream_names is None else \
+            set(stream_names)
+        # Streams of the latest discovery, queried from the next query on
+        self.new_stream_names = None
+        self.filter_pattern = filter_pattern
+        self.page_size = page_size
+        self.query_start = start_time
+        self.token = None
+        self.events = deque()
+        self.caught_up = False
+        self.last_timestamp = None
+        self.last_ids = set()
+
+    def add_streams(self, stream_names):
+        """
+        Also read these streams. The streams of stopped tasks are kept
+        while the total stays within MAX_STREAM_NAMES.
+        """
+        self.new_stream_names = set(stream_names)
+
+    def fetch(self):
+        if self.token is None:
+            if self.last_timestamp is not None:
+                self.query_start = self.last_timestamp
+            if self.new_stream_names is not None:
+                names = self.stream_names | self.new_stream_names
+                self.stream_names = names if \
+                    len(names) <= MAX_STREAM_NAMES else self.new_stream_names
+                self.new_stream_names = None
+        if self.stream_names is not None and not self.stream_names:
+            # No task has started a container yet
+            self.caught_up = True
+            return self
+        kwargs = {'logGroupName': self.group, 'limit': self.page_size}
+        if self.query_start is not None:
+            kwargs['startTime'] = self.query_start
+        if self.stream_prefix:
+            kwargs['logStreamNamePrefix'] = self.stream_prefix
+        if self.stream_names:
+            kwargs['logStreamNames'] = sorted(self.stream_names)
+        if self.filter_pattern:
+            kwargs['filterPattern'] = self.filter_pattern
+        if self.token:
+            kwargs['nextToken'] = self.token
+        response = self.client.filter_log_events(**kwargs)
+        for event in sorted(response.get('events', []),
+                            key=lambda i: i['timestamp']):
+            if event['timestamp'] == self.last_timestamp:
+                if event['eventId'] in self.last_ids:
+                    continue
+            elif self.last_timestamp is None or \
+                    event['timestamp'] > self.last_timestamp:
+                self.last_timestamp = event['timestamp']
+                self.last_ids = set()
+            self.last_ids.add(event['eventId'])
+            event['logGroupName'] = self.group
+            self.events.append(event)
+        self.token = response.get('nextToken')
+        self.caught_up = self.token is None
+        return self
+
+
+class LogTailer(object):
+    """
+    The CloudWatch logs of the tasks of an ECS service, merged by timestamp.
+
+    Every (log group, stream prefix) the service logs to is a LogSource,
+    fetched concurrently. Events are merged through a heap holding the next
+    event of each source, so memory stays at one page per source however
+    long the history or the follow. When following, every source is polled
+    again each min_interval seconds while events arrive and the interval
+    backs off towards max_interval while they do not.
+    """
+
+    def __init__(self, theo_ins, cluster, service, containers=None,
+                 since=DEFAULT_SINCE, filter_pattern=None, follow=False,
+                 min_interval=1.0, max_interval=10.0,
+                 discover_interval=DISCOVER_INTERVAL,
+                 max_workers=DEFAULT_MAX_WORKERS):
+        self.theo_ins = theo_ins
+        self.cluster = cluster
+        self.service = service
+        self.containers = containers
+        self.start_time = int((time.time() - since) * 1000)
+        self.filter_pattern = filter_pattern
+        self.follow = follow
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.discover_interval = discover_interval
+        self.max_workers = max_workers
+        self.sources = {}
+
+    def discover(self, start_time):
+        """
+        Add a LogSource for every place the service logs to that is not
+        read yet, and the streams of new tasks to the sources reading
+        streams by name
+        :param start_time: Milliseconds, where new sources start reading
+        """
+        sources = log_sources(self.theo_ins, self.cluster, self.service,
+                              self.containers)
+        for key, stream_names in sources.items():
+            if key in self.sources:
+                if stream_names:
+                    self.sources[key].add_streams(stream_names)
+                continue
+            region_name, group, stream_prefix = key
+            self.sources[key] = LogSource(
+                self.theo_ins.client('logs', region_name=region_name),
+                group, stream_prefix, start_time, self.filter_pattern,
+                stream_names=stream_names)
+
+    def _fill(self, sources):
+        """
+        Fetch pages until every source has events or is caught up
+        """
+        pending = [i for i in sources if not i.events and not i.caught_up]
+        while pending:
+            for _ in imap_unordered(LogSource.fetch, pending,
+                                    self.max_workers):
+                pass
+            pending = [i for i in pending if not i.events and not i.caught_up]
+
+    def _merge(self, sources):
+        self._fill(sources)
+        heap = [(source.events[0]['timestamp'], index, source)
+                for index, source in enumerate(sources) if source.events]
+        heapq.heapify(heap)
+        while heap:
+            _, index, source = heap[0]
+            yield source.events.popleft()
+            if not source.events:
+                # The next event of this source decides what comes next
+                self._fill([source])
+            if source.events:
+                heapq.heapreplace(
+                    heap, (source.events[0]['timestamp'], index, source))
+            else:
+                heapq.heappop(heap)
+
+    def events(self):
+        """
+        :return: Generator of filter_log_events event dicts with their
+        logGroupName, oldest first. Without follow it ends once the history
+        is printed.
+        :raises LogsError: When the service does not exist or none of its
+        containers log with awslogs
+        """
+        self.discover(self.start_time)
+        if not self.sources:
+            raise LogsError('None of the containers of {0} log to CloudWatch '
+                            'with the awslogs driver'.format(self.service))
+        interval = self.min_interval
+        discovered_at = time.time()
+        while True:
+            count = 0
+            for event in self._merge(list(self.sources.values())):
+                count += 1
+                yield event
+            if not self.follow:
+                return
+            if time.time() - discovered_at > self.discover_interval:
+                self.discover(int(discovered_at * 1000))
+                discovered_at = time.time()
+            interval = self.min_interval if count else \
+                min(interval * 1.5, self.max_interval)
+            time.sleep(interval)
+            for source in self.sources.values():
+                source.caught_up = False
@@ -0,0 +1,96 @@
+import csv
+import json
+import time
+
+import click
+import terminaltables
+
+FORMATS = ('table', 'json', 'jsonl', 'csv')
+# Seconds between flushes of the line oriented formats, so a consumer at the
+# other end of a pipe sees rows while the listing is still paging
+FLUSH_INTERVAL = 0.2
+
+
+def output_option(func):
+    return click.option(
+        '--output', type=click.Choice(FORMATS), default='table',
+        help='table collects every row before printing; json, jsonl and csv '
+             'are written row by row as the listing arrives.')(func)
+
+
+def _json_default(obj):
+    # boto3 returns datetimes
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError('{0!r} is not JSON serializable'.format(obj))
+
+
+def dumps(record):
+    return json.dumps(record, default=_json_default, sort_keys=True)
+
+
+class _Writer(object):
+    """
+    Write lines to a stream, flushing at most every FLUSH_INTERVAL seconds
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.flushed = time.time()
+
+    def write(self, data):
+        self.stream.write(data)
+        now = time.time()
+        if now - self.flushed > FLUSH_INTERVAL:
+            self.stream.flush()
+            self.flushed = now
+
+    def close(self):
+        self.stream.flush()
+
+
+def emit(records, output, headers, row, title=None, sort=False,
+         stream=None):
+    """
+    Print a listing
+    :param records: Iterable of dicts, e.g. straight from a listing
+    generator. json and jsonl print the dicts, table and csv print
+    row(record) under headers.
+    :param output: One of FORMATS
+    :param title: Printed above the table, table output only
+    :param sort: Sort the table rows, table output only since the other
+    formats are never held in memory
+    :return: Number of records printed
+    """
+    if output == 'table':
+        table_data = [row(i) for i in records]
+        if sort:
+            table_data.sort()
+        if title:
+            click.echo(click.style(title, fg='green'))
+        table_data.insert(0, headers)
+        click.echo(terminaltables.AsciiTable(table_data).table)
+        return len(table_data) - 1
+
+    writer = _Writer(stream or click.get_text_stream('stdout'))
+    count = 0
+    try:
+        if output == 'csv':
+            csv_writer = csv.writer(writer, lineterminator='\n')
+            csv_writer.writerow(headers)
+            for record in records:
+                csv_writer.writerow(row(record))
+                count += 1
+        elif output == 'jsonl':
+            for record in records:
+                writer.write(dumps(record) + '\n')
+                count += 1
+        else:
+            writer.write('[')
+            for record in records:
+                writer.write((',\n' if count else '\n') + dumps(record))
+                count += 1
+            writer.write('\n]\n' if count else ']\n')
+    finally:
+        writer.close()
+    return count
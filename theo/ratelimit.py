@@ -0,0 +1,146 @@
+import threading
+import time
+
+from .trace import THROTTLING_ERROR_CODES
+
+# Start near the sustained rate of the ECS and ECR APIs and probe upwards
+DEFAULT_RATE = 50.0
+DEFAULT_BURST = 100.0
+DEFAULT_MIN_RATE = 1.0
+DEFAULT_MAX_RATE = 500.0
+# Requests per second the rate grows by for every second without throttling
+DEFAULT_INCREASE = 2.0
+DEFAULT_DECREASE = 0.5
+# S3 scales per key prefix to thousands of requests per second, limiting it
+# like the control plane APIs would only slow theo down
+UNLIMITED_SERVICES = frozenset(['s3'])
+
+
+class AdaptiveTokenBucket(object):
+    """
+    Token bucket whose rate follows additive increase, multiplicative
+    decrease: every throttled response cuts the rate by decrease, at most
+    once per cooldown so a burst of throttles from concurrent workers
+    counts once, and every second without throttling adds increase
+    requests per second back, up to max_rate.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 min_rate=DEFAULT_MIN_RATE, max_rate=DEFAULT_MAX_RATE,
+                 increase=DEFAULT_INCREASE, decrease=DEFAULT_DECREASE,
+                 cooldown=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.throttles = 0
+        self._tokens = burst
+        self._updated = time.time()
+        self._last_decrease = 0.0
+        self._last_increase = self._updated
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available. Waiting callers
+        reserve their token up front, so they are served in order.
+        :return: Seconds waited
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self._lock:
+            now = time.time()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._refill(now)
+            # Idle time is no evidence the API takes more, count a second
+            # at most between two successes
+            self.rate = min(self.max_rate, self.rate + self.increase * min(
+                now - self._last_increase, 1.0))
+            self._last_increase = now
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.time()
+            self.throttles += 1
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop the burst allowance too, or the next burst throttles again
+            self._tokens = min(self._tokens, 0.0)
+            self._last_decrease = self._last_increase = now
+
+
+class RateLimiters(object):
+    """
+    The AdaptiveTokenBucket of every (service, region), shared by all the
+    clients they are installed on. AWS throttles per account, service and
+    region, so concurrent workers and the clients of different Theo
+    instances have to draw from the same bucket to stay under the limit
+    together instead of each retrying on its own.
+
+    :param rates: Dict of service name to the initial requests per second
+    """
+
+    def __init__(self, rates=None, **bucket_kwargs):
+        self.rates = rates or {}
+        self.bucket_kwargs = bucket_kwargs
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service, region_name):
+        key = (service, region_name)
+        with self._lock:
+            if key not in self._buckets:
+                kwargs = dict(self.bucket_kwargs)
+                if service in self.rates:
+                    kwargs['rate'] = self.rates[service]
+                self._buckets[key] = AdaptiveTokenBucket(**kwargs)
+            return self._buckets[key]
+
+    def install(self, client):
+        """
+        Make every HTTP attempt of client, retries included, take a token
+        from the shared bucket and feed the responses back into it
+        """
+        service = client.meta.service_model.service_name
+        if service in UNLIMITED_SERVICES:
+            return client
+        bucket = self.bucket(service, client.meta.region_name)
+
+        def before_send(**kwargs):
+            bucket.acquire()
+
+        def needs_retry(response=None, **kwargs):
+            if response is None:
+                return None
+            code = response[1].get('Error', {}).get('Code')
+            if code in THROTTLING_ERROR_CODES:
+                bucket.on_throttle()
+            elif response[0].status_code < 300:
+                bucket.on_success()
+            return None
+
+        client.meta.events.register_first('before-send', before_send)
+        client.meta.events.register('needs-retry', needs_retry)
+        return client
+
+
+default_rate_limiters = RateLimiters()
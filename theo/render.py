@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .cache import read_json, write_json_atomic
+from .deploy import clean_task_definition, family_name, \
+    task_definition_digest
+
+# State kept by each render process across its jobs: a Theo per profile,
+# all sharing one ClientPool, and a ComposeCache backed by the disk
+_worker = {}
+
+
+class RenderError(Exception):
+    pass
+
+
+def _worker_theo(profile_name):
+    from .clients import ClientPool
+    from .theo import Theo
+
+    theos = _worker.setdefault('theos', {})
+    if profile_name not in theos:
+        if 'clients' not in _worker:
+            _worker['clients'] = ClientPool()
+        theo_ins = Theo(profile_name, client_pool=_worker['clients'])
+        # Raises KeyError for profiles missing from .theo
+        theo_ins.load_settings(profile_name)
+        theos[profile_name] = theo_ins
+    return theos[profile_name]
+
+
+def render_job(job):
+    """
+    Render one compose file for one profile and write it, unless the file
+    already holds a task definition with the same digest. Runs in a render
+    process, only plain data goes in and out.
+    :param job: Dict of compose_file, profile, family, path, secrets and
+    execution_role_arn, see BatchRenderer.jobs
+    :return: The job with the render digest and whether the file changed,
+    or with an error message
+    """
+    from .utils import ComposeCache, ComposeECS
+
+    result = dict(job)
+    try:
+        if 'compose_cache' not in _worker:
+            _worker['compose_cache'] = ComposeCache(persistent=True)
+        task_definition = clean_task_definition(ComposeECS(
+            _worker_theo(job['profile']), job['family'], job['compose_file'],
+            compose_cache=_worker['compose_cache'],
+            secrets=job['secrets'],
+            execution_role_arn=job['execution_role_arn']).render())
+        digest = task_definition_digest(task_definition)
+        existing = read_json(job['path'])
+        changed = existing is None or \
+            task_definition_digest(existing) != digest
+        if changed:
+            directory = os.path.dirname(job['path'])
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            write_json_atomic(job['path'], task_definition, indent=2,
+                              sort_keys=True)
+        result.update(digest=digest, changed=changed)
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    return result
+
+
+class BatchRenderer(object):
+    """
+    Renders the task definitions of many compose files for many theo
+    profiles into output_dir/<profile>/<family>.json, on a pool of
+    max_workers processes.
+
+    Each compose file is parsed once up front into the persistent
+    ComposeCache, so the render processes load the parsed documents
+    instead of the YAML. Each process keeps a Theo per profile for all its
+    jobs, and S3 env files go through the on-disk S3EnvCache, which all
+    processes share. Output files whose task definition digest is
+    unchanged are not written, so their modification time only moves when
+    their content does.
+    """
+
+    def __init__(self, output_dir, secrets='ecs', max_workers=None,
+                 execution_role_arn=None):
+        """
+        :param secrets: See ComposeECS. 'ecs' by default, so secret values
+        are not written to the output files
+        :param max_workers: Number of processes, the number of CPUs by
+        default, 1 renders in this process
+        :param execution_role_arn: Overrides execution_role_arn of the
+        profiles
+        """
+        self.output_dir = output_dir
+        self.secrets = secrets
+        self.execution_role_arn = execution_role_arn
+        self.max_workers = max_workers
+
+    def jobs(self, compose_files, profiles):
+        """
+        :raises RenderError: When two compose files render the same family
+        """
+        families = {}
+        for compose_file in compose_files:
+            family = family_name(compose_file)
+            other = families.setdefault(family, compose_file)
+            if os.path.abspath(other) != os.path.abspath(compose_file):
+                raise RenderError('{0} and {1} both render family {2}'.format(
+                    other, compose_file, family))
+        return [{
+            'compose_file': compose_file,
+            'profile': profile,
+            'family': family,
+            'path': os.path.join(self.output_dir, profile, family + '.json'),
+            'secrets': self.secrets,
+            'execution_role_arn': self.execution_role_arn,
+        } for profile in profiles for family, compose_file in
+            sorted(families.items())]
+
+    def run(self, compose_files, profiles):
+        """
+        :return: Generator of render_job results in completion order
+        :raises RenderError: See jobs
+        """
+        from .utils import ComposeCache
+
+        jobs = self.jobs(compose_files, profiles)
+        compose_cache = ComposeCache(persistent=True)
+        for compose_file in set(i['compose_file'] for i in jobs):
+            try:
+                compose_cache.load(compose_file)
+            except Exception:
+                # Reported by the jobs of the file
+                pass
+
+        if self.max_workers == 1:
+            for job in jobs:
+                yield render_job(job)
+            return
+        executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        futures = []
+        try:
+            futures = [executor.submit(render_job, job) for job in jobs]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown()
@@ -0,0 +1,181 @@
+import threading
+
+from .concurrency import DEFAULT_MAX_WORKERS, chunked, imap_unordered
+
+SSM_PREFIX = 'ssm:'
+SECRETSMANAGER_PREFIX = 'secretsmanager:'
+# Maximum number of names a single ssm.get_parameters call accepts
+GET_PARAMETERS_BATCH = 10
+# Maximum number of IDs a single secretsmanager.batch_get_secret_value
+# call accepts
+BATCH_GET_SECRET_VALUE_BATCH = 20
+
+# Values are kept for the life of the process, they never touch the disk
+_values = {}
+_values_lock = threading.Lock()
+
+
+class SecretError(Exception):
+    pass
+
+
+def parse_reference(value):
+    """
+    >>> parse_reference('ssm:/prod/db/password')
+    ('ssm', '/prod/db/password')
+    >>> parse_reference('secretsmanager:prod/api-key')
+    ('secretsmanager', 'prod/api-key')
+    >>> parse_reference('hunter2') is None
+    True
+    """
+    if not hasattr(value, 'startswith'):
+        return None
+    for prefix in (SSM_PREFIX, SECRETSMANAGER_PREFIX):
+        if value.startswith(prefix) and len(value) > len(prefix):
+            return prefix[:-1], value[len(prefix):]
+    return None
+
+
+def clear_cache():
+    with _values_lock:
+        _values.clear()
+
+
+class SecretResolver(object):
+    """
+    Resolves ssm: and secretsmanager: references for one (aws profile,
+    region). Duplicate references are fetched once, the rest go out as
+    concurrent batches of GET_PARAMETERS_BATCH parameters and
+    BATCH_GET_SECRET_VALUE_BATCH secrets, and every value and ARN is
+    cached in memory for the rest of the process.
+    """
+
+    def __init__(self, theo_ins, max_workers=DEFAULT_MAX_WORKERS):
+        self.theo_ins = theo_ins
+        self.max_workers = max_workers
+        self.target = theo_ins.aws_target()
+
+    def _cached(self, reference):
+        with _values_lock:
+            return _values.get(self.target + reference)
+
+    def _store(self, reference, value, arn):
+        with _values_lock:
+            _values[self.target + reference] = {'value': value, 'arn': arn}
+
+    def _get_parameters(self, names):
+        response = self.theo_ins.client('ssm').get_parameters(
+            Names=names, WithDecryption=True)
+        if response.get('InvalidParameters'):
+            raise SecretError('SSM parameters not found: {0}'.format(
+                ', '.join(response['InvalidParameters'])))
+        found = {}
+        for parameter in response['Parameters']:
+            found[parameter['Name']] = parameter
+            found[parameter['ARN']] = parameter
+        return [(('ssm', name), found[name]['Value'], found[name]['ARN'])
+                for name in names]
+
+    def _get_secrets(self, names):
+        client = self.theo_ins.client('secretsmanager')
+        found = {}
+        kwargs = {'SecretIdList': names}
+        while True:
+            response = client.batch_get_secret_value(**kwargs)
+            if response.get('Errors'):
+                raise SecretError('Secrets not readable: {0}'.format(
+                    ', '.join('{0} ({1})'.format(i['SecretId'],
+                                                 i['ErrorCode'])
+                              for i in response['Errors'])))
+            for secret in response['SecretValues']:
+                found[secret['Name']] = secret
+                found[secret['ARN']] = secret
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+        unknown = [name for name in names if name not in found]
+        if unknown:
+            raise SecretError('Secrets not returned by their full name or '
+                              'ARN: {0}'.format(', '.join(unknown)))
+        # Secrets can be referred to by name or ARN, answer in the same terms
+        return [(('secretsmanager', name), found[name].get('SecretString'),
+                 found[name]['ARN']) for name in names]
+
+    def fetch(self, references):
+        """
+        Fetch every reference that is not cached yet
+        :param references: Iterable of (source, name) tuples
+        :raises SecretError: When a reference does not exist or cannot be
+        read
+        """
+        missing = set(i for i in references if self._cached(i) is None)
+        jobs = [(self._get_parameters, batch) for batch in chunked(
+            sorted(n for s, n in missing if s == 'ssm'),
+            GET_PARAMETERS_BATCH)]
+        jobs.extend((self._get_secrets, batch) for batch in chunked(
+            sorted(n for s, n in missing if s == 'secretsmanager'),
+            BATCH_GET_SECRET_VALUE_BATCH))
+        for results in imap_unordered(lambda job: job[0](job[1]), jobs,
+                                      self.max_workers):
+            for reference, value, arn in results:
+                self._store(reference, value, arn)
+
+    def value(self, reference):
+        return self._cached(reference)['value']
+
+    def value_from(self, reference):
+        """
+        The valueFrom of an ECS secrets entry: the name of an SSM parameter
+        in the task's region, or the full ARN, which Secrets Manager needs
+        """
+        source, name = reference
+        if source == 'ssm':
+            return name
+        if name.startswith('arn:'):
+            return name
+        return self._cached(reference)['arn']
+
+    def resolve_containers(self, containers, inline=True):
+        """
+        Replace the references in the environment of every container
+        definition, fetching them all in one round of batches first.
+        :param inline: True to inline the values into the environment,
+        False to move the references to the ECS secrets of the container
+        so the values are injected by ECS and never part of the task
+        definition
+        :return: containers, updated in place
+        """
+        references = set()
+        for container in containers:
+            for variable in container.get('environment') or []:
+                reference = parse_reference(variable.get('value'))
+                if reference is not None:
+                    references.add(reference)
+        if not references:
+            return containers
+        if inline:
+            self.fetch(references)
+        else:
+            # SSM parameters are referred to by name, only secrets looked
+            # up by name need their ARN
+            self.fetch(i for i in references if i[0] == 'secretsmanager' and
+                       not i[1].startswith('arn:'))
+
+        for container in containers:
+            environment = []
+            secrets = list(container.get('secrets') or [])
+            for variable in container.get('environment') or []:
+                reference = parse_reference(variable.get('value'))
+                if reference is None:
+                    environment.append(variable)
+                elif inline:
+                    environment.append({'name': variable['name'],
+                                        'value': self.value(reference)})
+                else:
+                    secrets.append({'name': variable['name'],
+                                    'valueFrom': self.value_from(reference)})
+            if 'environment' in container:
+                container['environment'] = environment
+            if secrets:
+                container['secrets'] = secrets
+        return containers
@@ -0,0 +1,139 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+
+from .cache import cache_dir, cache_key
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, writes are still atomic
+    fcntl = None
+
+SETTINGS_FILE = '.theo'
+
+
+class SettingsStore(object):
+    """
+    The .theo settings file, parsed once per process.
+
+    load() only re-reads the file when its mtime, size or inode changed.
+    Writes hold an exclusive lock on a lock file under ~/.cache/theo/locks,
+    keyed by the settings path so nothing is left in the project, re-read
+    the current content, and replace the file through a temporary file and a
+    rename, so concurrent jobs editing profiles neither lose updates nor
+    see a half written file.
+    """
+
+    def __init__(self, path=SETTINGS_FILE):
+        self.path = os.path.abspath(path)
+        self._data = None
+        self._stat = None
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        st = os.stat(self.path)
+        return (st.st_mtime, st.st_size, st.st_ino)
+
+    def _read(self):
+        signature = self._signature()
+        with open(self.path, 'r') as f:
+            data = json.load(f)
+        self._data, self._stat = data, signature
+        return data
+
+    def load(self):
+        """
+        :return: A copy of the settings dict
+        :raises IOError: When the file does not exist
+        """
+        with self._lock:
+            try:
+                signature = self._signature()
+            except OSError as e:
+                raise IOError(e.errno, e.strerror, self.path)
+            if self._data is None or signature != self._stat:
+                self._read()
+            return copy.deepcopy(self._data)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def update(self, func):
+        """
+        Apply func to the current settings and write the result
+        :param func: callable(settings dict) returning the new dict
+        :return: The new settings dict
+        """
+        with self._lock, self._file_lock():
+            data = func(self._read() if self.exists() else {})
+            self._write(data)
+            return copy.deepcopy(data)
+
+    def write(self, data):
+        """
+        Replace the settings file with data
+        """
+        with self._lock, self._file_lock():
+            self._write(data)
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.theo-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=4)
+            os.chmod(tmp_path, self._mode())
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        self._data, self._stat = copy.deepcopy(data), self._signature()
+
+    def _mode(self):
+        try:
+            return os.stat(self.path).st_mode & 0o777
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+    def _file_lock(self):
+        # Not .theo itself: the rename of each write replaces its inode
+        return _FileLock(os.path.join(cache_dir('locks'),
+                                      cache_key(self.path) + '.lock'))
+
+
+class _FileLock(object):
+    def __init__(self, path):
+        self.path = path
+        self.fp = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.fp = open(self.path, 'a')
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.fp is not None:
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+            self.fp.close()
+            self.fp = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_settings_store(path=SETTINGS_FILE):
+    """
+    The process wide SettingsStore for path
+    """
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SettingsStore(path)
+        return _stores[path]
@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+
+# Largest TemplateBody CloudFormation accepts inline, bigger templates have
+# to be passed as a TemplateURL
+TEMPLATE_BODY_LIMIT = 51200
+TEMPLATE_KEY_PREFIX = 'theo/templates/'
+
+_uploaded = set()
+_uploaded_lock = threading.Lock()
+
+
+class StackError(Exception):
+    pass
+
+
+def is_terminal(status):
+    return not status.endswith('_IN_PROGRESS') and \
+        (status.endswith('_COMPLETE') or status.endswith('_FAILED'))
+
+
+def is_success(status):
+    return status in ('CREATE_COMPLETE', 'UPDATE_COMPLETE', 'IMPORT_COMPLETE')
+
+
+def template_argument(s3_client, template_body, bucket_name=None):
+    """
+    The TemplateBody or TemplateURL argument for a CloudFormation call.
+    Templates above TEMPLATE_BODY_LIMIT are uploaded to bucket_name under
+    a key derived from their sha256, once: an existing object with that key
+    is reused.
+    :return: Dict with either TemplateBody or TemplateURL
+    """
+    data = template_body.encode('utf-8')
+    if len(data) <= TEMPLATE_BODY_LIMIT:
+        return {'TemplateBody': template_body}
+    if not bucket_name:
+        raise StackError(
+            'The template is {0} bytes, above the {1} bytes CloudFormation '
+            'accepts inline. Pass a template bucket to upload it to.'.format(
+                len(data), TEMPLATE_BODY_LIMIT))
+
+    key = TEMPLATE_KEY_PREFIX + hashlib.sha256(data).hexdigest() + '.json'
+    with _uploaded_lock:
+        uploaded = (bucket_name, key) in _uploaded
+    if not uploaded:
+        try:
+            s3_client.head_object(Bucket=bucket_name, Key=key)
+        except s3_client.exceptions.ClientError:
+            s3_client.put_object(Bucket=bucket_name, Key=key, Body=data)
+        with _uploaded_lock:
+            _uploaded.add((bucket_name, key))
+    return {'TemplateURL': 'https://{0}.s3.{1}.amazonaws.com/{2}'.format(
+        bucket_name, s3_client.meta.region_name, key)}
+
+
+class StackEventTailer(object):
+    """
+    Follows the events of a stack. Only events newer than the last one seen
+    are fetched: describe_stack_events pages newest first, so paging stops
+    at the last seen event ID. The poll interval grows while nothing
+    happens and resets when events arrive.
+    """
+
+    def __init__(self, cloudformation, stack_name, min_interval=2.0,
+                 max_interval=20.0):
+        self.cloudformation = cloudformation
+        self.stack_name = stack_name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.last_event_id = None
+
+    def prime(self):
+        """
+        Skip the events that already happened, e.g. before an update
+        """
+        events = self.cloudformation.describe_stack_events(
+            StackName=self.stack_name)['StackEvents']
+        if events:
+            self.last_event_id = events[0]['EventId']
+
+    def new_events(self):
+        """
+        :return: Events since the last call, oldest first
+        """
+        events = []
+        paginator = self.cloudformation.get_paginator('describe_stack_events')
+        for page in paginator.paginate(StackName=self.stack_name):
+            for event in page['StackEvents']:
+                if event['EventId'] == self.last_event_id:
+                    break
+                events.append(event)
+            else:
+                continue
+            break
+        if events:
+            self.last_event_id = events[0]['EventId']
+        return list(reversed(events))
+
+    def follow(self, timeout=None):
+        """
+        :return: Generator of stack events until the stack reaches a
+        terminal status
+        :raises StackError: When the stack ends up in a failed or rolled
+        back status, or on timeout
+        """
+        interval = self.min_interval
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            events = self.new_events()
+            for event in events:
+                yield event
+                if event['ResourceType'] == 'AWS::CloudFormation::Stack' and \
+                        event['LogicalResourceId'] == self.stack_name and \
+                        is_terminal(event['ResourceStatus']):
+                    if not is_success(event['ResourceStatus']):
+                        raise StackError('{0} ended in {1}'.format(
+                            self.stack_name, event['ResourceStatus']))
+                    return
+            if deadline and time.time() > deadline:
+                raise StackError('Timed out waiting for {0}'.format(
+                    self.stack_name))
+            interval = self.min_interval if events else \
+                min(interval * 1.5, self.max_interval)
+            time.sleep(interval)
+
+
+def create_change_set(cloudformation, stack_name, template, parameters,
+                      capabilities, poll_interval=2.0):
+    """
+    Create an update change set and wait until CloudFormation computed it
+    :param template: Result of template_argument
+    :return: (change set ID, list of changes), or (None, []) when the
+    update would not change anything; the empty change set is deleted
+    """
+    name = 'theo-{0}'.format(int(time.time()))
+    kwargs = dict(template)
+    response = cloudformation.create_change_set(
+        StackName=stack_name, ChangeSetName=name, ChangeSetType='UPDATE',
+        Parameters=parameters, Capabilities=capabilities, **kwargs)
+    change_set_id = response['Id']
+
+    while True:
+        description = cloudformation.describe_change_set(
+            ChangeSetName=change_set_id)
+        if description['Status'] in ('CREATE_COMPLETE', 'FAILED'):
+            break
+        time.sleep(poll_interval)
+
+    if description['Status'] == 'FAILED':
+        reason = description.get('StatusReason', '')
+        if "didn't contain changes" in reason or 'No updates' in reason:
+            cloudformation.delete_change_set(ChangeSetName=change_set_id)
+            return None, []
+        raise StackError('Change set failed: {0}'.format(reason))
+
+    changes = description['Changes']
+    while description.get('NextToken'):
+        description = cloudformation.describe_change_set(
+            ChangeSetName=change_set_id, NextToken=description['NextToken'])
+        changes.extend(description['Changes'])
+    return change_set_id, changes
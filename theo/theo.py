@@ -1,41 +1,160 @@
-import base64
 import json
+import os
+import re
+import tempfile
+import threading
 
-import boto3
-import docker
 import unipath
 
+from .clients import ClientPool, DEFAULT_MAX_POOL_CONNECTIONS
+from .concurrency import DEFAULT_MAX_WORKERS, chunked, fan_out, imap_unordered
+from .ecr import decode_authorization, default_token_cache, \
+    endpoint_registry_id
+from .images import CONTEXT_DIGEST_LABEL, CONTEXT_TAG_PREFIX, \
+    BuildContext, LayerProgress, iter_json_stream
+from .settings import get_settings_store
+from .stacks import StackEventTailer, create_change_set, template_argument
+from .trace import current_tracer
+
+# Maximum number of tasks a single ecs.describe_tasks call accepts
+DESCRIBE_TASKS_BATCH = 100
+# Maximum number of clusters a single ecs.describe_clusters call accepts
+DESCRIBE_CLUSTERS_BATCH = 100
+# Maximum number of services a single ecs.describe_services call accepts
+DESCRIBE_SERVICES_BATCH = 10
+
+
+class lazy_property(object):
+    """
+    Computes an attribute on first access and stores the result on the
+    instance, so later reads are plain attribute lookups. Assigning the
+    attribute directly (e.g. from a load_* method) replaces the cached value.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.__name__] = self.func(obj)
+        return value
+
+
+def read_settings(profile_name=None, store=None):
+    """
+    Read a single profile from the .theo settings file
+    :param profile_name: Name of the profile, defaults to the first one
+    :param store: SettingsStore, defaults to the one of the current directory
+    :return: The profile dict or None if there is no .theo file
+    """
+    store = store or get_settings_store()
+    try:
+        settings_obj = store.load()
+    except IOError:
+        return None
+    if profile_name:
+        return settings_obj[profile_name]
+    return settings_obj[list(settings_obj.keys())[0]]
+
+
+def default_aws_profile_name():
+    """
+    The AWS profile name a bare Theo() would use. Resolved from .theo or the
+    environment without creating a boto3 Session, so it is cheap enough to
+    use as a click option default.
+    """
+    settings = read_settings()
+    if settings is not None:
+        return settings['aws_profile_name']
+    return os.environ.get('AWS_PROFILE') or \
+        os.environ.get('AWS_DEFAULT_PROFILE') or 'default'
+
 
 class Theo(object):
-    def __init__(self, profile_name=None,aws_profile_name=None):
-        self.load_settings(profile_name)
-        self.load_credentials()
-        self.load_docker_client()
+    def __init__(self, profile_name=None,aws_profile_name=None,
+                 client_pool=None,
+                 max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS):
+        # Settings, the boto session and the docker client are created on
+        # first use (see the lazy properties below) so that building a Theo
+        # instance costs nothing for commands that never touch them.
+        self.profile_name = profile_name
+        self.max_pool_connections = max_pool_connections
+        if client_pool is not None:
+            self.clients = client_pool
 
-    def load_settings(self, profile_name):
-        try:
+    @lazy_property
+    def clients(self):
+        return ClientPool(self.max_pool_connections)
 
-            settings_obj = json.load(open('.theo', 'r'))
-            if profile_name:
-                self.settings = settings_obj[profile_name]
-            else:
-                self.settings = settings_obj[list(settings_obj.keys())[0]]
-        except IOError:
-            self.settings = None
+    @lazy_property
+    def token_cache(self):
+        return default_token_cache
+
+    @lazy_property
+    def settings_store(self):
+        return get_settings_store()
+
+    @lazy_property
+    def settings(self):
+        return read_settings(self.profile_name, self.settings_store)
+
+    @lazy_property
+    def boto_session(self):
+        return self.load_credentials()
+
+    @lazy_property
+    def docker_client(self):
+        return self.load_docker_client()
+
+    @lazy_property
+    def inventory(self):
+        from .inventory import Inventory
+
+        return Inventory(self)
+
+    def load_settings(self, profile_name):
+        self.profile_name = profile_name
+        self.settings = read_settings(profile_name, self.settings_store)
+        # The boto session is derived from the settings, rebuild it on next use
+        self.__dict__.pop('boto_session', None)
 
     def load_credentials(self):
         """
         Creates the Boto session
         """
-        if self.settings is not None:
-            self.boto_session = boto3.Session(
-                profile_name=self.settings['aws_profile_name'],
-                region_name=self.settings['aws_region_name']
-            )
-        else:
-            self.boto_session = boto3.Session()
+        self.boto_session = self.clients.session(*self.aws_target())
+        return self.boto_session
+
+    def aws_target(self, aws_profile_name=None, region_name=None):
+        """
+        Resolve the (aws profile, region) pair a call should use. Without an
+        explicit profile the one from the loaded settings is used, along with
+        its region.
+        """
+        if aws_profile_name is None and self.settings is not None:
+            return (self.settings['aws_profile_name'],
+                    region_name or self.settings['aws_region_name'])
+        return (aws_profile_name, region_name)
+
+    def client(self, service, aws_profile_name=None, region_name=None):
+        """
+        A pooled boto3 client, see ClientPool
+        """
+        return self.clients.client(
+            service, *self.aws_target(aws_profile_name, region_name))
+
+    def resource(self, service, aws_profile_name=None, region_name=None):
+        """
+        A pooled boto3 resource for the calling thread, see ClientPool
+        """
+        return self.clients.resource(
+            service, *self.aws_target(aws_profile_name, region_name))
 
-    def start_project(self, profile_name, aws_profile_name, aws_region_name, cluster, env_file):
+    def start_project(self, profile_name, aws_profile_name, aws_region_name, cluster, env_file,
+                      execution_role_arn=''):
         obj_dict = {
             profile_name: {
                 'aws_profile_name': aws_profile_name,
@@ -45,15 +164,15 @@ class Theo(object):
         }
         if env_file != '':
             obj_dict[profile_name]['env_file'] = env_file
+        if execution_role_arn:
+            obj_dict[profile_name]['execution_role_arn'] = execution_role_arn
 
-        file_obj = open('.theo', 'w+')
-        obj = json.dump(obj_dict, file_obj, indent=4)
-        file_obj.close()
+        self.settings_store.write(obj_dict)
         return obj_dict
 
-    def add_profile(self, profile_name, aws_profile_name, aws_region_name, cluster, env_file):
-        with open('.theo', 'r+') as f:
-            data = json.load(f)
+    def add_profile(self, profile_name, aws_profile_name, aws_region_name, cluster, env_file,
+                    execution_role_arn=''):
+        def add(data):
             data[profile_name] = {
                 'aws_profile_name': aws_profile_name,
                 'aws_region_name': aws_region_name,
@@ -61,36 +180,202 @@ class Theo(object):
             }
             if env_file != '':
                 data[profile_name]['env_file'] = env_file
-            f.seek(0)  # <--- should reset file position to the beginning.
-            json.dump(data, f, indent=4)
+            if execution_role_arn:
+                data[profile_name]['execution_role_arn'] = \
+                    execution_role_arn
             return data
 
+        return self.settings_store.update(add)
+
     def list_profiles(self):
-        file_obj = open('.theo', 'r')
-        obj = json.load(file_obj)
-        file_obj.close()
-        return list(obj.keys())
+        return list(self.settings_store.load().keys())
 
     def load_docker_client(self):
-        self.docker_client = docker.Client(
-            base_url='unix://var/run/docker.sock')
+        import docker
+
+        self.docker_client = docker.Client(base_url=os.environ.get(
+            'DOCKER_HOST', 'unix://var/run/docker.sock'))
+        tracer = current_tracer()
+        if tracer is not None:
+            self.docker_client = tracer.instrument_docker(self.docker_client)
+        return self.docker_client
 
     def list_clusters(self,aws_profile_name):
-        ecs = boto3.Session(profile_name=aws_profile_name).client('ecs')
-        return ecs.list_clusters()['clusterArns']
+        return list(self.iter_cluster_arns(aws_profile_name))
+
+    def iter_cluster_arns(self, aws_profile_name=None, region_name=None):
+        ecs = self.client('ecs', aws_profile_name, region_name)
+        for page in ecs.get_paginator('list_clusters').paginate():
+            for arn in page['clusterArns']:
+                yield arn
+
+    def iter_clusters(self, aws_profile_name=None, region_name=None):
+        """
+        Every cluster of one (aws profile, region), described in batches
+        of DESCRIBE_CLUSTERS_BATCH. The dicts include the running/pending
+        task and container instance counts.
+        :return: Generator of ecs.describe_clusters cluster dicts
+        """
+        ecs = self.client('ecs', aws_profile_name, region_name)
+        for arns in chunked(self.iter_cluster_arns(aws_profile_name,
+                                                   region_name),
+                            DESCRIBE_CLUSTERS_BATCH):
+            for cluster in ecs.describe_clusters(clusters=arns)['clusters']:
+                yield cluster
+
+    def fan_out_clusters(self, targets, max_workers=DEFAULT_MAX_WORKERS,
+                         timeout=None):
+        """
+        Describe the clusters of many (aws profile, region) pairs at once
+        :param targets: List of (aws_profile_name, region_name) tuples
+        :param timeout: Seconds a single target may take before it is
+        reported as timed out
+        :return: Generator of (target, clusters, error) tuples in completion
+        order, see concurrency.fan_out
+        """
+        def describe(target):
+            return list(self.iter_clusters(*target))
+
+        return fan_out(describe, targets, max_workers, timeout)
+
+    def available_aws_profiles(self):
+        return self.clients.session().available_profiles
 
     def list_tasks(self, aws_profile_name, cluster):
-        ecs = boto3.Session(profile_name=aws_profile_name).client('ecs')
-        return ecs .list_tasks(
-            cluster=cluster)['taskArns']
+        return list(self.iter_task_arns(cluster, aws_profile_name))
+
+    def iter_task_arns(self, cluster, aws_profile_name=None,
+                       desired_status=None, service_name=None):
+        """
+        Walk every page of ecs.list_tasks
+        :param cluster: Cluster name or ARN
+        :param desired_status: RUNNING, PENDING or STOPPED
+        :param service_name: Only tasks belonging to this service
+        :return: Generator of task ARNs
+        """
+        ecs = self.client('ecs', aws_profile_name)
+        kwargs = {'cluster': cluster}
+        if desired_status:
+            kwargs['desiredStatus'] = desired_status
+        if service_name:
+            kwargs['serviceName'] = service_name
+        for page in ecs.get_paginator('list_tasks').paginate(**kwargs):
+            for arn in page['taskArns']:
+                yield arn
+
+    def describe_tasks(self, cluster, task_arns, aws_profile_name=None):
+        """
+        Describe up to DESCRIBE_TASKS_BATCH tasks in a single call
+        """
+        ecs = self.client('ecs', aws_profile_name)
+        return ecs.describe_tasks(cluster=cluster, tasks=task_arns)['tasks']
+
+    def iter_tasks(self, cluster, aws_profile_name=None, desired_status=None,
+                   service_name=None, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Stream the full task inventory of a cluster. Task ARNs are paged in
+        and described in batches of DESCRIBE_TASKS_BATCH on a bounded thread
+        pool; the tasks of each batch are yielded as soon as it returns, so
+        the order is not stable.
+        :return: Generator of ecs.describe_tasks task dicts
+        """
+        batches = chunked(
+            self.iter_task_arns(cluster, aws_profile_name, desired_status,
+                                service_name),
+            DESCRIBE_TASKS_BATCH)
+
+        def describe(task_arns):
+            return self.describe_tasks(cluster, task_arns, aws_profile_name)
+
+        for tasks in imap_unordered(describe, batches, max_workers):
+            for task in tasks:
+                yield task
+
+    def iter_service_arns(self, cluster, aws_profile_name=None):
+        ecs = self.client('ecs', aws_profile_name)
+        for page in ecs.get_paginator('list_services').paginate(
+                cluster=cluster):
+            for arn in page['serviceArns']:
+                yield arn
+
+    def describe_services(self, cluster, services, aws_profile_name=None):
+        """
+        Describe up to DESCRIBE_SERVICES_BATCH services in a single call
+        """
+        ecs = self.client('ecs', aws_profile_name)
+        return ecs.describe_services(cluster=cluster,
+                                     services=services)['services']
+
+    def iter_services(self, cluster, aws_profile_name=None,
+                      max_workers=DEFAULT_MAX_WORKERS):
+        """
+        Every service of a cluster, described in batches of
+        DESCRIBE_SERVICES_BATCH on a bounded thread pool, in completion order
+        :return: Generator of ecs.describe_services service dicts
+        """
+        def describe(service_arns):
+            return self.describe_services(cluster, service_arns,
+                                          aws_profile_name)
+
+        for services in imap_unordered(
+                describe, chunked(self.iter_service_arns(cluster,
+                                                         aws_profile_name),
+                                  DESCRIBE_SERVICES_BATCH),
+                max_workers):
+            for service in services:
+                yield service
 
     def get_ecr_credentials(self, registry_id):
-        client = self.boto_session.client('ecr')
-        response = client.get_authorization_token(registryIds=[registry_id])
-        password = base64.b64decode(
-            response['authorizationData'][0]['authorizationToken']).lstrip('AWS:')
-        endpoint = response['authorizationData'][0]['proxyEndpoint'].replace('https://', '')
-        return (password, endpoint)
+        creds = self.get_ecr_credentials_many([registry_id])[registry_id]
+        return (creds['password'], creds['endpoint'])
+
+    def get_ecr_credentials_many(self, registry_ids):
+        """
+        Docker login credentials for several ECR registries. Tokens come from
+        the token cache while they are valid, the rest are fetched with one
+        get_authorization_token call, plus one for the default registry.
+        :param registry_ids: List of registry (AWS account) IDs, None stands
+        for the default registry of the current credentials
+        :return: Dict of registry ID to {'password', 'endpoint', 'expires_at'}
+        """
+        client = self.client('ecr')
+        aws_profile_name = self.aws_target()[0]
+        region_name = client.meta.region_name
+        result = {}
+        missing = []
+        for registry_id in registry_ids:
+            token = self.token_cache.get(registry_id, aws_profile_name,
+                                         region_name)
+            if token is None:
+                missing.append(registry_id)
+            else:
+                result[registry_id] = token
+        if not missing:
+            return result
+
+        # Explicit registries in one call; the default registry needs a
+        # call without registryIds, which only ever answers for it
+        by_registry = {}
+        explicit = [i for i in missing if i is not None]
+        if explicit:
+            response = client.get_authorization_token(registryIds=explicit)
+            by_registry.update(
+                (endpoint_registry_id(i['endpoint']), i) for i in
+                map(decode_authorization, response['authorizationData']))
+        if None in missing:
+            response = client.get_authorization_token()
+            by_registry[None] = decode_authorization(
+                response['authorizationData'][0])
+        for registry_id in missing:
+            token = by_registry.get(registry_id)
+            if token is None:
+                raise KeyError(
+                    'No ECR authorization returned for registry {0}'.format(
+                        registry_id))
+            self.token_cache.put(registry_id, aws_profile_name, region_name,
+                                 token)
+            result[registry_id] = token
+        return result
 
     def get_required_parameters(self, filename):
         """
@@ -106,32 +391,309 @@ class Theo(object):
         return [i[0] for i in req_params]
 
     def get_template_body(self, template_path):
-        return open(template_path, 'r').read()
+        with open(template_path, 'r') as f:
+            return f.read()
 
-    def create_cluster(self, stack_name,parameters,aws_profile_name, aws_region_name):
-        client = boto3.Session(profile_name=aws_profile_name,
-                               region_name=aws_region_name).client('cloudformation')
-
-        template_path = unipath.Path(
+    def default_template_path(self):
+        return unipath.Path(
             __file__).ancestor(1).child('cloudformation').child('ecs.json')
 
+    def template_argument(self, aws_profile_name, aws_region_name,
+                          template_bucket=None):
+        """
+        TemplateBody, or TemplateURL once uploaded to template_bucket when
+        the template is too big to send inline, see stacks.template_argument
+        """
+        return template_argument(
+            self.client('s3', aws_profile_name, aws_region_name),
+            self.get_template_body(self.default_template_path()),
+            template_bucket)
+
+    def create_cluster(self, stack_name,parameters,aws_profile_name, aws_region_name,
+                       template_bucket=None):
+        client = self.client('cloudformation', aws_profile_name,
+                             aws_region_name)
+
         response = client.create_stack(
             StackName=stack_name,
-            TemplateBody=self.get_template_body(template_path),
             Parameters=parameters,
             Capabilities=[
                 'CAPABILITY_IAM',
-                ]
+                ],
+            **self.template_argument(aws_profile_name, aws_region_name,
+                                     template_bucket)
             )
         return response['StackId']
 
-    def push_image(self, file_path=None, prebuilt_image_name=None):
+    def plan_cluster_update(self, stack_name, parameters, aws_profile_name,
+                            aws_region_name, template_bucket=None):
+        """
+        Create a change set updating the stack to Theo's current template
+        :return: (change set ID, list of changes), (None, []) when the update
+        would be a no-op
+        """
+        client = self.client('cloudformation', aws_profile_name,
+                             aws_region_name)
+        return create_change_set(
+            client, stack_name,
+            self.template_argument(aws_profile_name, aws_region_name,
+                                   template_bucket),
+            parameters, ['CAPABILITY_IAM'])
+
+    def execute_change_set(self, change_set_id, aws_profile_name,
+                           aws_region_name):
+        client = self.client('cloudformation', aws_profile_name,
+                             aws_region_name)
+        client.execute_change_set(ChangeSetName=change_set_id)
+
+    def stack_events(self, stack_name, aws_profile_name, aws_region_name,
+                     skip_existing=False, timeout=None):
+        """
+        Follow a stack's events until it settles, see StackEventTailer
+        :param skip_existing: Only report events from now on
+        """
+        tailer = StackEventTailer(
+            self.client('cloudformation', aws_profile_name, aws_region_name),
+            stack_name)
+        if skip_existing:
+            tailer.prime()
+        return tailer.follow(timeout)
+
+    def push_image(self, file_path=None, prebuilt_image_name=None,
+                   repository=None, tags=None, progress=None, buildargs=None):
+        """
+        Push a local image, or one built from a Dockerfile, to ECR.
+
+        A Dockerfile build is skipped, along with its push, when ECR already
+        holds an image tagged with the build context digest (see
+        images.BuildContext); the requested tags are added to that image.
+        When the image was pushed to the repository before (it has a repo
+        digest for it) and ECR reports all of its layers as available with
+        batch_check_layer_availability, the tags are added to the existing
+        manifest and nothing is uploaded. Otherwise every tag is pushed
+        through the docker daemon, streaming its progress events.
+        :param file_path: Path to a Dockerfile to build first
+        :param prebuilt_image_name: Name or ID of a local image
+        :param repository: ECR repository name or URI
+        :param tags: List of tags, defaults to ['latest']
+        :param progress: Optional callable(image, event) called for every
+        docker progress event as it arrives
+        :param buildargs: Dict of build args for file_path
+        :return: Dict with 'image', 'repository', 'tags', 'skipped' and the
+        per-layer 'layers' summary of LayerProgress
+        """
         if file_path and prebuilt_image_name:
-            raise ValueError('Both file_path an')
+            raise ValueError('Both file_path and prebuilt_image_name were '
+                             'given, only one is allowed')
+        if not (file_path or prebuilt_image_name):
+            raise ValueError('Either file_path or prebuilt_image_name is '
+                             'required')
+        if repository is None:
+            raise ValueError('repository is required')
+        tags = list(tags or ['latest'])
+        repository_uri = self.repository_uri(repository)
+        report = {
+            'image': prebuilt_image_name,
+            'repository': repository_uri,
+            'tags': tags,
+            'skipped': False,
+            'layers': [],
+        }
+
+        push_tags = tags
+        if file_path:
+            context = BuildContext(file_path, buildargs)
+            context_tag = CONTEXT_TAG_PREFIX + context.digest
+            if self.tag_remote_image(repository_uri, context_tag, tags):
+                report['image'] = context_tag
+                report['skipped'] = True
+                return report
+            report['image'] = self.build_image(context)
+            push_tags = tags + [context_tag]
+        elif self.tag_existing_image(prebuilt_image_name, repository_uri,
+                                     tags):
+            report['skipped'] = True
+            return report
+        image = report['image']
+
+        password, _ = self.get_ecr_credentials(
+            endpoint_registry_id(repository_uri))
+        auth_config = {'username': 'AWS', 'password': password}
+        layers = LayerProgress()
+        for tag in push_tags:
+            self.docker_client.tag(image, repository_uri, tag=tag)
+            stream = self.docker_client.push(repository_uri, tag=tag,
+                                             stream=True,
+                                             auth_config=auth_config)
+            for event in iter_json_stream(stream):
+                layers.update(event)
+                if progress is not None:
+                    progress(image, event)
+        report['layers'] = layers.summary()
+        return report
+
+    def push_images(self, jobs, max_workers=4, progress=None):
+        """
+        Push several images concurrently, see push_image. Each repository
+        URI is resolved once and passed on as the job's repository, and each
+        registry's token is fetched once; a job whose repository or token
+        cannot be resolved reports the error like any other failure.
+        :param jobs: List of dicts of push_image keyword arguments
+        :return: Generator of (job, report, error) tuples in completion order
+        """
+        lock = threading.Lock()
+        uris = {}
+        registry_locks = {}
+
+        def push(index):
+            job = dict(jobs[index])
+            repository = job['repository']
+            if repository not in uris:
+                uris[repository] = self.repository_uri(repository)
+            job['repository'] = uris[repository]
+            registry_id = endpoint_registry_id(job['repository'])
+            with lock:
+                registry_lock = registry_locks.setdefault(registry_id,
+                                                          threading.Lock())
+            # One worker per registry fetches its token, the others wait
+            # and find it in the token cache
+            with registry_lock:
+                self.get_ecr_credentials(registry_id)
+            return self.push_image(progress=progress, **job)
+
+        for index, report, error in fan_out(push, range(len(jobs)),
+                                            max_workers):
+            yield jobs[index], report, error
+
+    def repository_uri(self, repository):
+        """
+        :param repository: ECR repository name or URI
+        :return: The repository URI
+        """
+        if '/' in repository and '.dkr.ecr.' in repository.split('/')[0]:
+            return repository
+        return self.describe_repository(repository)['repositoryUri']
+
+    def describe_repository(self, repository_name):
+        client = self.client('ecr')
+        return client.describe_repositories(
+            repositoryNames=[repository_name])['repositories'][0]
+
+    def tag_existing_image(self, image, repository_uri, tags):
+        """
+        Add tags to an image that is already in ECR without pushing it. Only
+        possible when the local image carries a digest for repository_uri and
+        all of that manifest's layers are available in the registry.
+        :return: True when the tags were added, False when a push is needed
+        """
+        repo_digests = self.docker_client.inspect_image(image).get(
+            'RepoDigests') or []
+        digests = [i.split('@', 1)[1] for i in repo_digests
+                   if i.split('@', 1)[0] == repository_uri]
+        if not digests:
+            return False
+
+        client = self.client('ecr')
+        registry_id = endpoint_registry_id(repository_uri)
+        repository_name = repository_uri.split('/', 1)[1]
+        images = client.batch_get_image(
+            registryId=registry_id, repositoryName=repository_name,
+            imageIds=[{'imageDigest': digests[0]}])['images']
+        if not images:
+            return False
+        manifest = images[0]['imageManifest']
+        layer_digests = [i['digest'] for i in
+                         json.loads(manifest).get('layers', [])]
+        if layer_digests:
+            availability = client.batch_check_layer_availability(
+                registryId=registry_id, repositoryName=repository_name,
+                layerDigests=layer_digests)
+            if availability['failures'] or any(
+                    i['layerAvailability'] != 'AVAILABLE'
+                    for i in availability['layers']):
+                return False
+
+        self.put_image_tags(repository_uri, images[0], tags)
+        return True
+
+    def tag_remote_image(self, repository_uri, source_tag, tags):
+        """
+        Add tags to the image tagged source_tag in ECR, if there is one
+        :return: True when the tags were added
+        """
+        client = self.client('ecr')
+        images = client.batch_get_image(
+            registryId=endpoint_registry_id(repository_uri),
+            repositoryName=repository_uri.split('/', 1)[1],
+            imageIds=[{'imageTag': source_tag}])['images']
+        if not images:
+            return False
+        self.put_image_tags(repository_uri, images[0], tags)
+        return True
+
+    def put_image_tags(self, repository_uri, image, tags):
+        """
+        Tag an ECR image by re-putting its manifest
+        :param image: An image dict from ecr.batch_get_image
+        """
+        client = self.client('ecr')
+        kwargs = {
+            'registryId': endpoint_registry_id(repository_uri),
+            'repositoryName': repository_uri.split('/', 1)[1],
+            'imageManifest': image['imageManifest'],
+        }
+        if image.get('imageManifestMediaType'):
+            kwargs['imageManifestMediaType'] = image['imageManifestMediaType']
+        for tag in tags:
+            try:
+                client.put_image(imageTag=tag, **kwargs)
+            except client.exceptions.ImageAlreadyExistsException:
+                pass
 
     def list_repos(self):
-        client = self.boto_session.client('ecr')
-        return client.describe_repositories()['repositories']
+        return list(self.iter_repos())
+
+    def iter_repos(self):
+        paginator = self.client('ecr').get_paginator('describe_repositories')
+        for page in paginator.paginate():
+            for repository in page['repositories']:
+                yield repository
+
+    def build_dockerfile(self, file_path, tag=None, buildargs=None):
+        """
+        Build an image from a Dockerfile, using its directory as the context
+        :return: The image ID
+        """
+        return self.build_image(BuildContext(file_path, buildargs), tag)
+
+    def build_image(self, context, tag=None):
+        """
+        Build a BuildContext unless a local image already carries its
+        context digest label. The context tarball is streamed from a
+        temporary file rather than assembled in memory.
+        :return: The image ID
+        """
+        existing = self.docker_client.images(filters={
+            'label': '{0}={1}'.format(CONTEXT_DIGEST_LABEL, context.digest)})
+        if existing:
+            image_id = existing[0]['Id']
+            if tag:
+                repository, _, image_tag = tag.partition(':')
+                self.docker_client.tag(image_id, repository,
+                                       tag=image_tag or None)
+            return image_id
 
-    def build_dockerfile(self, file_path):
-        self.docker_client.build()
+        image_id = None
+        with tempfile.TemporaryFile() as fileobj:
+            context.write(fileobj)
+            fileobj.seek(0)
+            stream = self.docker_client.build(
+                fileobj=fileobj, custom_context=True,
+                dockerfile=context.dockerfile, tag=tag, rm=True, stream=True,
+                buildargs=context.buildargs)
+            for event in iter_json_stream(stream):
+                match = re.match(r'Successfully built (\w+)',
+                                 event.get('stream', ''))
+                if match:
+                    image_id = match.group(1)
+        return image_id
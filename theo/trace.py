@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+import types
+
+# Error codes AWS services use when a caller is rate limited
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'ProvisionedThroughputExceededException',
+    'TransactionInProgressException',
+    'RequestLimitExceeded',
+    'BandwidthLimitExceeded',
+    'LimitExceededException',
+    'RequestThrottled',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'EC2ThrottledException',
+])
+
+_CONTEXT_KEY = 'theo_trace'
+
+
+def _body_size(body):
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if isinstance(body, type(u'')):
+        return len(body.encode('utf-8'))
+    if isinstance(body, dict):
+        # Query protocol bodies are still a dict of parameters here
+        return len('&'.join('{0}={1}'.format(k, v) for k, v in body.items()))
+    return 0
+
+
+def _content_length(http_response):
+    try:
+        return int(http_response.headers.get('Content-Length', 0))
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+class Tracer(object):
+    """
+    Records the AWS and docker calls of a process. Every call becomes a
+    span of (category, name, start, duration, thread, args); summary()
+    aggregates them per operation and chrome_trace() exports them for
+    chrome://tracing or Perfetto.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, category, name, start, duration, **args):
+        with self._lock:
+            self.spans.append({
+                'category': category,
+                'name': name,
+                'start': start,
+                'duration': duration,
+                'thread': threading.current_thread().ident,
+                'args': args,
+            })
+
+    def instrument_session(self, session):
+        """
+        Hook the botocore event system of a boto3 session. Clients copy the
+        handlers of their session when they are created, so this has to
+        run before the session creates any client.
+        """
+        events = session.events
+        events.register('before-call', self._before_call,
+                        unique_id='theo-trace-before-call')
+        events.register('after-call', self._after_call,
+                        unique_id='theo-trace-after-call')
+        events.register('after-call-error', self._after_call_error,
+                        unique_id='theo-trace-after-call-error')
+        events.register('needs-retry', self._needs_retry,
+                        unique_id='theo-trace-needs-retry')
+        return session
+
+    def _before_call(self, model=None, params=None, context=None, **kwargs):
+        context[_CONTEXT_KEY] = {
+            'start': time.time(),
+            'bytes_out': _body_size(params.get('body')),
+            'attempts': 1,
+            'throttles': 0,
+        }
+
+    def _needs_retry(self, response=None, request_dict=None, attempts=1,
+                     **kwargs):
+        state = (request_dict or {}).get('context', {}).get(_CONTEXT_KEY)
+        if state is None:
+            return None
+        state['attempts'] = attempts
+        if response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            state['throttles'] += 1
+        return None
+
+    def _finish(self, name, context, **args):
+        state = context.pop(_CONTEXT_KEY, None)
+        if state is None:
+            return
+        self.record('aws', name, state['start'], time.time() - state['start'],
+                    throttles=state['throttles'],
+                    bytes_out=state['bytes_out'], **args)
+
+    def _after_call(self, http_response=None, parsed=None, model=None,
+                    context=None, **kwargs):
+        metadata = parsed.get('ResponseMetadata', {})
+        error = parsed.get('Error', {}).get('Code') \
+            if http_response.status_code >= 300 else None
+        self._finish('{0}.{1}'.format(model.service_model.service_name,
+                                      model.name), context,
+                     retries=metadata.get('RetryAttempts', 0),
+                     bytes_in=_content_length(http_response),
+                     status=http_response.status_code, error=error)
+
+    def _after_call_error(self, exception=None, context=None,
+                          event_name='', **kwargs):
+        # Connection errors and the like, no response was parsed. The
+        # event has no operation model, the name is in the event name.
+        state = context.get(_CONTEXT_KEY) or {}
+        self._finish(event_name.split('.', 1)[-1], context,
+                     retries=state.get('attempts', 1) - 1, bytes_in=0,
+                     status=None, error=type(exception).__name__)
+
+    def instrument_docker(self, docker_client):
+        return TracedDockerClient(docker_client, self)
+
+    def summary(self):
+        """
+        :return: List of per operation dicts sorted by total time, slowest
+        first: name, calls, errors, retries, throttles, total, mean, max,
+        bytes_in, bytes_out
+        """
+        with self._lock:
+            spans = list(self.spans)
+        rows = {}
+        for span in spans:
+            row = rows.setdefault((span['category'], span['name']), {
+                'category': span['category'],
+                'name': span['name'],
+                'calls': 0,
+                'errors': 0,
+                'retries': 0,
+                'throttles': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'bytes_in': 0,
+                'bytes_out': 0,
+            })
+            args = span['args']
+            row['calls'] += 1
+            row['errors'] += 1 if args.get('error') else 0
+            row['retries'] += args.get('retries', 0)
+            row['throttles'] += args.get('throttles', 0)
+            row['total'] += span['duration']
+            row['max'] = max(row['max'], span['duration'])
+            row['bytes_in'] += args.get('bytes_in', 0)
+            row['bytes_out'] += args.get('bytes_out', 0)
+        for row in rows.values():
+            row['mean'] = row['total'] / row['calls']
+        return sorted(rows.values(), key=lambda i: -i['total'])
+
+    def chrome_trace(self):
+        """
+        :return: The spans in the Chrome trace event format
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events = [{
+            'name': span['name'],
+            'cat': span['category'],
+            'ph': 'X',
+            'ts': int((span['start'] - self.started) * 1e6),
+            'dur': int(span['duration'] * 1e6),
+            'pid': pid,
+            'tid': span['thread'],
+            'args': span['args'],
+        } for span in spans]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class TracedDockerClient(object):
+    """
+    Proxy of a docker.Client recording every API method call. Streaming
+    calls (push, pull, build with stream=True) are recorded when the
+    stream is exhausted or closed.
+    """
+
+    def __init__(self, client, tracer):
+        self._client = client
+        self._tracer = tracer
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        tracer = self._tracer
+
+        def traced(*args, **kwargs):
+            start = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                tracer.record('docker', name, start, time.time() - start,
+                              error=type(e).__name__)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return self._traced_stream(name, start, result)
+            tracer.record('docker', name, start, time.time() - start)
+            return result
+
+        return traced
+
+    def _traced_stream(self, name, start, stream):
+        bytes_in = 0
+        error = None
+        try:
+            for chunk in stream:
+                bytes_in += len(chunk) if isinstance(
+                    chunk, (bytes, type(u''))) else 0
+                yield chunk
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._tracer.record('docker', name, start, time.time() - start,
+                                bytes_in=bytes_in, error=error)
+
+
+_tracer = None
+
+
+def enable_tracing():
+    """
+    Start recording calls for the rest of the process
+    :return: The process wide Tracer
+    """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def current_tracer():
+    """
+    :return: The process wide Tracer, None while tracing is off
+    """
+    return _tracer
@@ -1,13 +1,35 @@
-import ConfigParser, os
+import copy
+import hashlib
+import io
+import os
+import threading
 import yaml
 import botocore
 
+from .cache import cache_dir, cache_key, read_json, write_json_atomic
+from .secrets import SecretError, SecretResolver
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
+
+try:
+    # libyaml bindings, several times faster than the pure Python loader
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 
 ECS_MAP = {
     'mem_limit':'memory',
     'read_only':'readonlyRootFilesystem',
     'security_opt':'dockerSecurityOptions'
 }
+
+# ComposeECS methods named convert_* that do not convert a compose key
+NOT_CONVERTERS = ('convert_docker_env',)
+
 class NoSectionWrapper(object):
     def __init__(self, fp):
         self.fp = fp
@@ -22,6 +44,78 @@ class NoSectionWrapper(object):
         else:
             return self.fp.readline()
 
+    def __iter__(self):
+        # Python 3's ConfigParser.read_file iterates instead of readline()
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+
+def parse_env_file(fp):
+    """
+    Parse an INI style env file without section header
+    :param fp: File-like object
+    :return: List of ECS environment dicts
+    """
+    config = ConfigParser.ConfigParser()
+    if hasattr(config, 'read_file'):
+        config.read_file(NoSectionWrapper(fp))
+    else:
+        config.readfp(NoSectionWrapper(fp))
+    return [{
+                'name': k.upper(),
+                'value': v
+            } for k, v in config.items('vars')]
+
+
+class S3EnvCache(object):
+    """
+    Parsed S3 env files kept on disk with their ETag. A cached file is
+    revalidated with a conditional GET, so an unchanged file costs a 304
+    response and no download. Entries are keyed by AWS profile, bucket and
+    key and only readable by the current user, as env files tend to hold
+    credentials.
+    """
+
+    def __init__(self, path=None):
+        self._path = path
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = cache_dir('s3env')
+        return self._path
+
+    def load(self, s3_client, bucket_name, s3_key, aws_profile_name=None):
+        """
+        :return: List of ECS environment dicts
+        """
+        cache_file = os.path.join(self.path, cache_key(
+            aws_profile_name, bucket_name, s3_key) + '.json')
+        cached = read_json(cache_file)
+        kwargs = {}
+        if cached is not None:
+            kwargs['IfNoneMatch'] = cached['etag']
+        try:
+            response = s3_client.get_object(Bucket=bucket_name, Key=s3_key,
+                                            **kwargs)
+        except botocore.exceptions.ClientError as e:
+            if cached is not None and \
+                    e.response['Error']['Code'] in ('304', 'NotModified'):
+                return cached['vars']
+            raise Exception(
+                'Your credentials were not able to download {0}'.format(
+                    s3_key))
+        body = response['Body'].read().decode('utf-8')
+        env_vars = parse_env_file(io.StringIO(body))
+        write_json_atomic(cache_file, {'etag': response['ETag'],
+                                       'vars': env_vars})
+        return env_vars
+
+
+default_s3_env_cache = S3EnvCache()
+
 
 def _raise_invalid_port(port):
     raise ValueError('Invalid port "%s", should be '
@@ -87,39 +181,205 @@ def convert_ports(port_str):
     return port_dict
 
 
+def environment_entries(value):
+    """
+    A compose environment, a dict or a list of NAME=value, as ECS
+    environment entries. ECS entries, e.g. from env files, are kept.
+    >>> environment_entries(['A=1', 'B'])
+    [{'name': 'A', 'value': '1'}, {'name': 'B', 'value': ''}]
+    """
+    if isinstance(value, dict):
+        items = sorted(value.items())
+    else:
+        items = [(i['name'], i.get('value')) if isinstance(i, dict) else
+                 i.partition('=')[::2] for i in value]
+    return [{'name': name, 'value': '' if v is None else str(v)}
+            for name, v in items]
+
+
+def merge_environment(entries, overrides):
+    """
+    ECS environment entries with overrides replacing entries of the same
+    name
+    """
+    names = set(i['name'] for i in overrides)
+    return [i for i in entries if i['name'] not in names] + overrides
+
+
+def load_compose(file_path, loader=SafeLoader):
+    with open(file_path, 'rb') as f:
+        return yaml.load(f, Loader=loader)
+
+
+class ComposeCache(object):
+    """
+    Parsed compose documents keyed by path and a sha256 of the file
+    content, so an unchanged file is hashed instead of parsed again. The
+    latest document of each path is kept in memory; with persistent=True
+    documents are also stored as JSON under ~/.cache/theo/compose so other
+    processes can reuse them. Callers get their own deep copy.
+    """
+
+    def __init__(self, persistent=False, path=None, loader=SafeLoader):
+        self.persistent = persistent
+        self.loader = loader
+        self._path = path
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        if self._path is None:
+            self._path = cache_dir('compose')
+        return self._path
+
+    def load(self, file_path):
+        file_path = os.path.abspath(file_path)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            cached = self._memory.get(file_path)
+        if cached is not None and cached[0] == digest:
+            return copy.deepcopy(cached[1])
+
+        doc = None
+        cache_file = None
+        if self.persistent:
+            cache_file = os.path.join(self.path,
+                                      cache_key(file_path, digest) + '.json')
+            doc = read_json(cache_file)
+        if doc is None:
+            doc = yaml.load(data, Loader=self.loader)
+            if cache_file is not None:
+                try:
+                    write_json_atomic(cache_file, doc)
+                except TypeError:
+                    # Not JSON serializable (e.g. YAML timestamps), memory only
+                    pass
+        with self._lock:
+            self._memory[file_path] = (digest, doc)
+        return copy.deepcopy(doc)
+
+
+default_compose_cache = ComposeCache()
+
+
 class ComposeECS(object):
-    def __init__(self, theo_ins, family_name, file_path):
+    # Converters added with register_converter, per class
+    _extra_converters = {}
+
+    def __init__(self, theo_ins, family_name, file_path,
+                 env_cache=default_s3_env_cache,
+                 compose_cache=default_compose_cache, secrets='ecs',
+                 execution_role_arn=None):
+        """
+        :param env_cache: S3EnvCache for env files on S3, None to download
+        them on every render
+        :param compose_cache: ComposeCache for the compose file, None to
+        parse it every time
+        :param secrets: What render does with ssm: and secretsmanager:
+        environment values: 'inline' resolves them, 'ecs' turns them into
+        ECS secrets entries, None leaves them as they are
+        :param execution_role_arn: The task execution role, which ECS needs
+        to inject secrets. Defaults to execution_role_arn of the profile.
+        """
         self.theo_ins = theo_ins
         self.family_name = family_name
         self.file_path = file_path
-        self.compose = yaml.load(open(self.file_path))
+        self.env_cache = env_cache
+        self.secrets = secrets
+        self.execution_role_arn = execution_role_arn
+        # Parsed env files of this render, by path or (bucket, key)
+        self._env_files = {}
+        if compose_cache is not None:
+            self.compose = compose_cache.load(self.file_path)
+        else:
+            self.compose = load_compose(self.file_path)
         self.compose_services = self.compose.get('services', {})
         self.compose_volumes = self.compose.get('volumes', {})
 
+    @classmethod
+    def converters(cls):
+        """
+        The converter registry of this class, built once: a dict of compose
+        key to either a callable(self, compose_dict, ecs_dict) returning the
+        updated ecs_dict, or the ECS key name the value is copied to.
+        Sources, lowest precedence first: ECS_MAP, the convert_<key>
+        methods, then register_converter calls on this class and its bases.
+        """
+        registry = cls.__dict__.get('_converter_registry')
+        if registry is None:
+            registry = dict(ECS_MAP)
+            for name in dir(cls):
+                if name.startswith('convert_') and \
+                        name not in NOT_CONVERTERS:
+                    registry[name[len('convert_'):]] = getattr(cls, name)
+            for klass in reversed(cls.__mro__):
+                registry.update(klass.__dict__.get('_extra_converters', {}))
+            cls._converter_registry = registry
+        return registry
+
+    @classmethod
+    def register_converter(cls, key, converter=None):
+        """
+        Register a converter for a compose key, replacing any existing one.
+        Usable as a decorator:
+
+            @ComposeECS.register_converter('healthcheck')
+            def convert_healthcheck(compose_ecs, compose_dict, ecs_dict):
+                ...
+                return ecs_dict
+
+        :param converter: callable(self, compose_dict, ecs_dict) or the ECS
+        key name to copy the value to
+        """
+        def register(converter):
+            if '_extra_converters' not in cls.__dict__:
+                cls._extra_converters = {}
+            cls._extra_converters[key] = converter
+            cls._reset_converters()
+            return converter
+
+        if converter is None:
+            return register
+        return register(converter)
+
+    @classmethod
+    def _reset_converters(cls):
+        if '_converter_registry' in cls.__dict__:
+            del cls._converter_registry
+        for subclass in cls.__subclasses__():
+            subclass._reset_converters()
+
+    def _convert_service(self, name, compose_dict, converters=None):
+        """
+        Convert one compose service to an ECS container definition
+        """
+        converters = converters or self.converters()
+        ecs_dict = {
+            'name': name
+        }
+        for k, v in compose_dict.items():
+            converter = converters.get(k)
+            if converter is None:
+                # If we don't have a converter for the key
+                # just set it and forget it
+                ecs_dict[k] = v
+            elif callable(converter):
+                ecs_dict = converter(self, compose_dict, ecs_dict)
+            else:
+                ecs_dict[converter] = v
+        return ecs_dict
+
     def containers(self):
-        # Create the list of containers that we will eventually return
-        ecs_list = []
-        # Loop over the compose_services dict
-        for name, obj in self.compose_services.items():
-            # Create ecs dict that we will add to the ecs_list
-            ecs_dict = {
-                'name': name
-            }
-            for k in obj.keys():
-                meth_name = 'convert_{0}'.format(k)
-                # Check to see if we have a method for converting this key
-                if hasattr(self, meth_name):
-                    ecs_dict = getattr(self, meth_name)(obj, ecs_dict)
-                elif k in list(ECS_MAP.keys()):
-                    ecs_name = ECS_MAP[k]
-                    ecs_dict[ecs_name] = obj[k]
-                else:
-                    # If we don't have a method for converting the key
-                    # just set it and forget it
-                    ecs_dict[k] = obj[k]
-
-            ecs_list.append(ecs_dict)
-        return ecs_list
+        """
+        :return: List of ECS container definitions in compose order
+        """
+        converters = self.converters()
+        return [self._convert_service(name, compose_dict, converters)
+                for name, compose_dict in self.compose_services.items()]
 
     def convert_dns(self,compose_dict, ecs_dict):
         dns = compose_dict['dns']
@@ -175,10 +435,38 @@ class ComposeECS(object):
                 })
         return ecs_dict
 
+    def log_configuration(self, compose_dict):
+        """
+        The ECS logConfiguration of a compose service, from logging (version
+        2 and 3 files) or log_driver and log_opt (version 1 files). awslogs
+        defaults its region to the profile's, ECS requires one.
+        """
+        logging = compose_dict.get('logging') or {}
+        driver = logging.get('driver', compose_dict.get('log_driver'))
+        options = logging.get('options', compose_dict.get('log_opt')) or {}
+        if not driver:
+            return None
+        # Docker log options are all strings, compose allows numbers
+        options = dict((k, str(v)) for k, v in options.items())
+        if driver == 'awslogs' and 'awslogs-region' not in options and \
+                self.theo_ins.settings:
+            options['awslogs-region'] = \
+                self.theo_ins.settings['aws_region_name']
+        log_configuration = {'logDriver': driver}
+        if options:
+            log_configuration['options'] = options
+        return log_configuration
+
     def convert_logging(self, compose_dict, ecs_dict):
-        
+        log_configuration = self.log_configuration(compose_dict)
+        if log_configuration:
+            ecs_dict['logConfiguration'] = log_configuration
         return ecs_dict
 
+    # log_driver and log_opt are read together whichever comes first
+    convert_log_driver = convert_logging
+    convert_log_opt = convert_logging
+
     def convert_labels(self, compose_dict, ecs_dict):
         labels = compose_dict['labels']
         if isinstance(labels,dict):
@@ -212,7 +500,16 @@ class ComposeECS(object):
             env_file = self.theo_ins.settings['env_file']
         else:
             env_file = compose_dict['env_file']
-        ecs_dict['environment'] = self.convert_docker_env(env_file)
+        # environment takes precedence over env files, as in compose
+        ecs_dict['environment'] = merge_environment(
+            self.convert_docker_env(env_file),
+            ecs_dict.get('environment', []))
+        return ecs_dict
+
+    def convert_environment(self, compose_dict, ecs_dict):
+        ecs_dict['environment'] = merge_environment(
+            ecs_dict.get('environment', []),
+            environment_entries(compose_dict['environment'] or []))
         return ecs_dict
 
     def convert_ports(self, compose_dict, ecs_dict):
@@ -225,58 +522,67 @@ class ComposeECS(object):
         return
 
     def convert_docker_env(self,file_path):
-        is_s3 = False
-        if file_path.startswith('s3://'):
-            file_path = self.download_from_s3(*self.parse_s3_url(file_path))
-            is_s3 = True
-
-        config = ConfigParser.ConfigParser()
-        config.readfp(NoSectionWrapper(open(file_path)))
-
-        vars_list = [{
-                         'name': k.upper(),
-                         'value': v
-                     } for k, v in config.items('vars')]
-        if is_s3:
-            self.delete_file(file_path)
-        return vars_list
-
-    def delete_file(self,file_path):
-        os.remove(file_path)
-
-    def parse_s3_url(self, s3_url):
         """
-        Parse the S3 url. Format: s3://mybucket:path/to/my/key
-        Example: s3://settings-bucket:/production_settings.py
-        :param s3_url: Path to the file hosted on S3
-        :return:
+        Env files are parsed once per render no matter how many services
+        use them. S3 files are read straight into memory. ssm: and
+        secretsmanager: references are left for render() to resolve, in
+        one batch for all services.
         """
-        return s3_url.replace('s3://', '').split(':')
+        if file_path not in self._env_files:
+            if file_path.startswith('s3://'):
+                env_vars = self.load_s3_env(*self.parse_s3_url(file_path))
+            else:
+                with open(file_path) as f:
+                    env_vars = parse_env_file(f)
+            self._env_files[file_path] = env_vars
+        # Every container gets its own copies
+        return [dict(i) for i in self._env_files[file_path]]
 
-    def download_from_s3(self, bucket_name, s3_key,
-                             output_filename='.s3_env'):
+    def load_s3_env(self, bucket_name, s3_key):
         """
-        Download a file from S3
-        :param bucket_name: Name of the S3 bucket (string)
-        :param s3_key: Name of the file hosted on S3 (string)
-        :param output_filename: Name of the file the download operation
-        will create (string)
-        :return: False or the value of output_filename
+        Read and parse an env file hosted on S3 without touching the disk,
+        other than the optional S3EnvCache
+        :return: List of ECS environment dicts
         """
-        s3 = self.theo_ins.boto_session.resource('s3')
-        bucket = s3.Bucket(bucket_name)
+        s3 = self.theo_ins.client('s3')
+        if self.env_cache is not None:
+            return self.env_cache.load(s3, bucket_name, s3_key,
+                                       self.theo_ins.aws_target()[0])
         try:
-            s3.meta.client.head_object(Bucket=bucket_name, Key=s3_key)
+            response = s3.get_object(Bucket=bucket_name, Key=s3_key)
         except botocore.exceptions.ClientError:
             raise Exception(
                 'Your credentials were not able to download {0}'.format(
                     s3_key))
-        bucket.download_file(s3_key, output_filename)
-        return output_filename
+        return parse_env_file(io.StringIO(response['Body'].read().decode(
+            'utf-8')))
+
+    def parse_s3_url(self, s3_url):
+        """
+        Parse the S3 url. Format: s3://mybucket:path/to/my/key
+        Example: s3://settings-bucket:/production_settings.py
+        :param s3_url: Path to the file hosted on S3
+        :return:
+        """
+        return s3_url.replace('s3://', '').split(':')
 
     def render(self):
-        return {
+        containers = self.containers()
+        if self.secrets is not None:
+            SecretResolver(self.theo_ins).resolve_containers(
+                containers, inline=self.secrets == 'inline')
+        task_definition = {
             'family': self.family_name,
-            'containerDefinitions': self.containers(),
+            'containerDefinitions': containers,
             'volumes': self.volumes()
         }
+        execution_role_arn = self.execution_role_arn or \
+            (self.theo_ins.settings or {}).get('execution_role_arn')
+        if execution_role_arn:
+            task_definition['executionRoleArn'] = execution_role_arn
+        elif any(i.get('secrets') for i in containers):
+            raise SecretError(
+                '{0} has ECS secrets, which need a task execution role: set '
+                'execution_role_arn in the profile or pass '
+                '--execution_role'.format(self.family_name))
+        return task_definition
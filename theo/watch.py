@@ -0,0 +1,163 @@
+import time
+
+from .concurrency import DEFAULT_MAX_WORKERS, chunked, imap_unordered
+from .inventory import task_family
+from .theo import DESCRIBE_TASKS_BATCH
+
+# What a poll reports for each task or service
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+
+class Watcher(object):
+    """
+    Polls a listing and reports what changed since the previous poll. The
+    poll interval is min_interval while anything changes or is in
+    transition, e.g. during a deploy, and backs off towards max_interval
+    while everything is steady.
+    """
+
+    def __init__(self, min_interval=2.0, max_interval=30.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.snapshot = {}
+
+    def current(self):
+        """
+        :return: Dict of key to item, the listing as it is now
+        """
+        raise NotImplementedError
+
+    def fingerprint(self, item):
+        """
+        The fields of an item whose change is reported
+        """
+        raise NotImplementedError
+
+    def in_transition(self, item):
+        return False
+
+    def poll(self):
+        """
+        :return: List of (ADDED | REMOVED | CHANGED, old item, new item)
+        tuples, every item is ADDED on the first poll
+        """
+        current = self.current()
+        changes = []
+        for key, item in current.items():
+            old = self.snapshot.get(key)
+            if old is None:
+                changes.append((ADDED, None, item))
+            elif self.fingerprint(old) != self.fingerprint(item):
+                changes.append((CHANGED, old, item))
+        for key, old in self.snapshot.items():
+            if key not in current:
+                changes.append((REMOVED, old, None))
+        self.snapshot = current
+        return changes
+
+    def watch(self):
+        """
+        :return: Endless generator of the changes of every poll, see poll
+        """
+        interval = self.min_interval
+        while True:
+            changes = self.poll()
+            yield changes
+            busy = changes or any(self.in_transition(i)
+                                  for i in self.snapshot.values())
+            interval = self.min_interval if busy else \
+                min(interval * 1.5, self.max_interval)
+            time.sleep(interval)
+
+
+class TaskWatcher(Watcher):
+    """
+    The tasks of a cluster, as ecs.list_tasks lists them. Every poll pages
+    through the task ARNs, but only describes ARNs that appeared and tasks
+    whose last status had not reached their desired status yet. A task
+    that reached it only changes by leaving the listing, so steady tasks
+    cost nothing but their ARN.
+    """
+
+    def __init__(self, theo_ins, cluster, aws_profile_name=None,
+                 desired_status=None, service_name=None, family=None,
+                 max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+        super(TaskWatcher, self).__init__(**kwargs)
+        self.theo_ins = theo_ins
+        self.cluster = cluster
+        self.aws_profile_name = aws_profile_name
+        self.desired_status = desired_status
+        self.service_name = service_name
+        self.family = family
+        self.max_workers = max_workers
+        # Every listed task, the family filter is applied on top
+        self.tasks = {}
+
+    def current(self):
+        listed = set(self.theo_ins.iter_task_arns(
+            self.cluster, self.aws_profile_name, self.desired_status,
+            self.service_name))
+        stale = [arn for arn in listed if arn not in self.tasks or
+                 self.in_transition(self.tasks[arn])]
+
+        def describe(task_arns):
+            return self.theo_ins.describe_tasks(self.cluster, task_arns,
+                                                self.aws_profile_name)
+
+        tasks = dict((arn, self.tasks[arn]) for arn in listed
+                     if arn in self.tasks)
+        for batch in imap_unordered(describe,
+                                    chunked(stale, DESCRIBE_TASKS_BATCH),
+                                    self.max_workers):
+            for task in batch:
+                tasks[task['taskArn']] = task
+        self.tasks = tasks
+        return dict((arn, task) for arn, task in tasks.items()
+                    if self.family is None or task_family(task) == self.family)
+
+    def fingerprint(self, task):
+        return (task.get('lastStatus'), task.get('desiredStatus'),
+                task.get('healthStatus'), task.get('taskDefinitionArn'),
+                task.get('containerInstanceArn'), task.get('startedAt'))
+
+    def in_transition(self, task):
+        return task.get('lastStatus') != task.get('desiredStatus')
+
+
+class ServiceWatcher(Watcher):
+    """
+    The services of a cluster. ECS lists services without their state, so
+    every poll describes them all, DESCRIBE_SERVICES_BATCH per call. Their
+    events are dropped from the snapshot, they are not part of the listing.
+    """
+
+    def __init__(self, theo_ins, cluster, aws_profile_name=None,
+                 max_workers=DEFAULT_MAX_WORKERS, **kwargs):
+        super(ServiceWatcher, self).__init__(**kwargs)
+        self.theo_ins = theo_ins
+        self.cluster = cluster
+        self.aws_profile_name = aws_profile_name
+        self.max_workers = max_workers
+
+    def current(self):
+        services = {}
+        for service in self.theo_ins.iter_services(
+                self.cluster, self.aws_profile_name, self.max_workers):
+            service.pop('events', None)
+            services[service['serviceArn']] = service
+        return services
+
+    def fingerprint(self, service):
+        return (service.get('status'), service.get('desiredCount'),
+                service.get('runningCount'), service.get('pendingCount'),
+                service.get('taskDefinition'),
+                tuple((i['id'], i['status'], i.get('rolloutState'),
+                       i.get('runningCount'))
+                      for i in service.get('deployments', [])))
+
+    def in_transition(self, service):
+        return len(service.get('deployments', [])) > 1 or \
+            service.get('pendingCount', 0) > 0 or \
+            service.get('runningCount') != service.get('desiredCount')